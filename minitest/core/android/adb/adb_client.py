@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import socket
+import struct
+import threading
+import time
+from collections import defaultdict
+
+from logger import get_logger
+from minitest.core.android.adb.exceptions import AdbException
+
+LOGGER = get_logger(__name__)
+
+
+class AdbConnection(object):
+    """
+    One TCP connection to the adb server.
+
+    https://android.googlesource.com/platform/system/core/+/master/adb/OVERVIEW.TXT
+    https://android.googlesource.com/platform/system/core/+/master/adb/SERVICES.TXT
+
+    Every request is sent as a 4 hex digits length followed by the payload, the server answers with
+    `OKAY` or `FAIL` followed by a 4 hex digits length and the error message.
+    """
+
+    def __init__(self, host, port, timeout=None):
+        try:
+            self.socket = socket.create_connection((host, port), timeout=5.0)
+        except socket.error as e:
+            raise AdbException('can not connect to adb server {}:{} ({})'.format(host, port, e))
+        self.socket.settimeout(timeout)
+
+    def send(self, request):
+        data = request.encode('utf-8')
+        self.socket.sendall('{:04x}'.format(len(data)).encode('ascii') + data)
+
+    def recv_exactly(self, size):
+        buf = bytearray(size)
+        view = memoryview(buf)
+        received = 0
+        while received < size:
+            n = self.socket.recv_into(view[received:], size - received)
+            if n == 0:
+                raise AdbException('adb connection closed')
+            received += n
+        return bytes(buf)
+
+    def recv_all(self):
+        chunks = []
+        while True:
+            chunk = self.socket.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def recv_string(self):
+        length = int(self.recv_exactly(4), 16)
+        return self.recv_exactly(length).decode('utf-8')
+
+    def check_status(self):
+        status = self.recv_exactly(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise AdbException(self.recv_string())
+        raise AdbException('unexpected adb status: {}'.format(status))
+
+    def request(self, request):
+        self.send(request)
+        self.check_status()
+
+    def close(self):
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AdbClient(object):
+    """
+    Talk to the adb server over its host-service protocol instead of spawning an `adb` process per command.
+
+    Host services (`host:...`) and device services (`shell:`, `exec:`, `sync:`) are supported. A device
+    service consumes its connection, except `sync:` which can be reused, so idle sync connections are
+    pooled per serial.
+    """
+
+    SYNC_DATA_MAX = 64 * 1024
+
+    # packet ids of the shell v2 protocol, each packet is the id, a 4 bytes little endian length and the data
+    SHELL_STDOUT, SHELL_STDERR, SHELL_EXIT = 1, 2, 3
+    # sent to the device, same id as the exit packet
+    SHELL_CLOSE_STDIN = 3
+
+    def __init__(self, host=None, port=None, serial=None, pool_size=4):
+        host = host if host else '127.0.0.1'
+        # '127.0.0.0' is what pyadb.ADB uses to mean the local adb server
+        self.host = '127.0.0.1' if host in ['localhost', '127.0.0.0'] else host
+        self.port = int(port) if port else 5037
+        self.serial = serial
+
+        self.pool_size = pool_size
+        self._sync_pool = defaultdict(list)
+        self._pool_lock = threading.Lock()
+        self._features = {}
+
+    def connect(self, timeout=None):
+        return AdbConnection(self.host, self.port, timeout=timeout)
+
+    def _transport(self, conn, serial=None):
+        serial = serial or self.serial
+        conn.request('host:transport:{}'.format(serial) if serial else 'host:transport-any')
+
+    def _host_prefix(self, serial=None):
+        serial = serial or self.serial
+        return 'host-serial:{}'.format(serial) if serial else 'host'
+
+    def host_query(self, request):
+        """
+        Send a host request whose answer is a length-prefixed string
+
+        """
+        with self.connect() as conn:
+            conn.request(request)
+            return conn.recv_string()
+
+    def version(self):
+        return int(self.host_query('host:version'), 16)
+
+    def devices(self):
+        """
+        Return list of (serial, state) tuples
+        adb devices
+        """
+        output = self.host_query('host:devices')
+        return [tuple(line.split('\t')[:2]) for line in output.splitlines() if line.strip()]
+
+    def features(self, serial=None):
+        """
+        Return the set of features supported by both the device and the adb server, read once per serial
+        adb features
+        """
+        serial = serial or self.serial
+        if serial not in self._features:
+            try:
+                output = self.host_query('{}:features'.format(self._host_prefix(serial)))
+            except AdbException as e:
+                # adb servers older than the features request
+                LOGGER.debug('can not read adb features: {}'.format(e))
+                return set()
+            self._features[serial] = set(output.strip().split(','))
+        return self._features[serial]
+
+    def open_service(self, service, serial=None, timeout=None):
+        """
+        Switch a new connection to the device transport and open a device service on it
+
+        Returns:
+            the connection, its socket streams the service output until the service ends
+
+        """
+        conn = self.connect(timeout=timeout)
+        try:
+            self._transport(conn, serial)
+            conn.request(service)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def shell(self, cmd, serial=None, timeout=None):
+        """
+        Run a shell command
+        adb shell <cmd>
+
+        Returns:
+            (stdout, stderr, exit code) as raw output. Without the `shell_v2` feature (devices older than
+            Android 7) the device merges stderr into stdout and does not report the exit code: stderr is then
+            empty and the exit code is None.
+
+        The command gets no input, its stdin is closed.
+
+        """
+        if 'shell_v2' not in self.features(serial):
+            # half-closing the connection would end the whole stream, stdin is redirected instead
+            with self.open_service('shell:exec </dev/null; {}'.format(cmd), serial, timeout) as conn:
+                return conn.recv_all(), b'', None
+
+        streams = {self.SHELL_STDOUT: [], self.SHELL_STDERR: []}
+        exit_code = None
+        with self.open_service('shell,v2,raw:{}'.format(cmd), serial, timeout) as conn:
+            conn.socket.sendall(struct.pack('<BI', self.SHELL_CLOSE_STDIN, 0))
+            while exit_code is None:
+                try:
+                    packet_id, length = struct.unpack('<BI', conn.recv_exactly(5))
+                except AdbException:
+                    # closed without an exit packet, e.g. the device has gone
+                    break
+                data = conn.recv_exactly(length)
+                if packet_id == self.SHELL_EXIT:
+                    exit_code = ord(data[:1]) if data else 0
+                elif packet_id in streams:
+                    streams[packet_id].append(data)
+        return b''.join(streams[self.SHELL_STDOUT]), b''.join(streams[self.SHELL_STDERR]), exit_code
+
+    def exec_out(self, cmd, serial=None, timeout=None):
+        """
+        Run a command without pty and return its binary output
+        adb exec-out <cmd>
+        """
+        with self.open_service('exec:{}'.format(cmd), serial, timeout) as conn:
+            return conn.recv_all()
+
+    def forward(self, local, remote, serial=None, norebind=False):
+        """
+        adb forward [--no-rebind] <local> <remote>
+        """
+        request = '{}:forward:{}{};{}'.format(
+            self._host_prefix(serial), 'norebind:' if norebind else '', local, remote)
+        with self.connect() as conn:
+            conn.request(request)
+            # the first OKAY acknowledges the request, the second one reports the forward result
+            conn.check_status()
+
+    def forward_remove(self, local, serial=None):
+        """
+        adb forward --remove <local>
+        """
+        with self.connect() as conn:
+            conn.request('{}:killforward:{}'.format(self._host_prefix(serial), local))
+            conn.check_status()
+
+    def forward_list(self):
+        """
+        Return list of (serial, local, remote) tuples
+        adb forward --list
+        """
+        output = self.host_query('host:list-forward')
+        return [tuple(line.split()[:3]) for line in output.splitlines() if len(line.split()) >= 3]
+
+    def _acquire_sync(self, serial):
+        with self._pool_lock:
+            if self._sync_pool[serial]:
+                return self._sync_pool[serial].pop()
+        return self.open_service('sync:', serial)
+
+    def _release_sync(self, serial, conn):
+        with self._pool_lock:
+            if len(self._sync_pool[serial]) < self.pool_size:
+                self._sync_pool[serial].append(conn)
+                return
+        conn.close()
+
+    def push(self, local, remote, mode=None, serial=None):
+        """
+        Push a local file with the sync protocol, the file mode is kept by default
+        adb push local remote
+
+        Returns:
+            number of bytes pushed
+
+        """
+        serial = serial or self.serial
+        mode = os.stat(local).st_mode & 0o777 if mode is None else mode
+        conn = self._acquire_sync(serial)
+        try:
+            pushed = self._sync_send(conn, local, remote, mode)
+        except Exception:
+            conn.close()
+            raise
+        self._release_sync(serial, conn)
+        return pushed
+
+    def _sync_send(self, conn, local, remote, mode):
+        def sync_request(cmd, length):
+            return cmd + struct.pack('<I', length)
+
+        path_and_mode = '{},{}'.format(remote, mode).encode('utf-8')
+        conn.socket.sendall(sync_request(b'SEND', len(path_and_mode)) + path_and_mode)
+
+        pushed = 0
+        with open(local, 'rb') as f:
+            while True:
+                chunk = f.read(self.SYNC_DATA_MAX)
+                if not chunk:
+                    break
+                conn.socket.sendall(sync_request(b'DATA', len(chunk)) + chunk)
+                pushed += len(chunk)
+        conn.socket.sendall(sync_request(b'DONE', int(os.path.getmtime(local) or time.time())))
+
+        status, length = struct.unpack('<4sI', conn.recv_exactly(8))
+        if status == b'FAIL':
+            raise AdbException(conn.recv_exactly(length).decode('utf-8'))
+        if status != b'OKAY':
+            raise AdbException('unexpected sync status: {}'.format(status))
+        return pushed
+
+    def close(self):
+        with self._pool_lock:
+            for conns in self._sync_pool.values():
+                for conn in conns:
+                    conn.close()
+            self._sync_pool.clear()
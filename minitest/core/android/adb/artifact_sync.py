@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import re
+import threading
+
+from logger import get_logger
+from minitest.core.android.adb.exceptions import AdbException
+
+LOGGER = get_logger(__name__)
+
+MD5SUM_PATTERN = re.compile(r'^([0-9a-f]{32})\s+(\S+)$')
+
+
+class ArtifactSync(object):
+    """
+    Push local artifacts (binaries, libraries, apks) to the device only when the device copy differs.
+
+    Local md5 sums are computed once per file version (path, mtime, size), device md5 sums of all artifacts
+    are read with a single `md5sum` shell call, and what is known to be on every device is remembered per
+    serial for the whole process, so provisioning a device a second time costs no adb call at all.
+    """
+
+    _local_md5 = {}
+    _device_md5 = {}
+    _lock = threading.Lock()
+
+    def __init__(self, adb):
+        self.adb = adb
+
+    @property
+    def serial(self):
+        return self.adb.serial or self.adb.get_target_device() or self.adb.getprop('ro.serialno')
+
+    @classmethod
+    def local_md5(cls, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime, stat.st_size)
+        with cls._lock:
+            md5 = cls._local_md5.get(key)
+        if md5 is None:
+            h = hashlib.md5()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            md5 = h.hexdigest()
+            with cls._lock:
+                cls._local_md5[key] = md5
+        return md5
+
+    def device_md5(self, remote_paths):
+        """
+        Read the md5 sums of several device files with a single shell call
+
+        Returns:
+            dict of device path and md5, missing files (or devices without md5sum) are left out
+
+        """
+        outputs = self.adb.shell_command('md5sum {} 2>/dev/null'.format(' '.join(remote_paths)))
+        md5s = {}
+        for output in outputs or []:
+            m = MD5SUM_PATTERN.match(output)
+            if m:
+                md5s[m.group(2)] = m.group(1)
+        return md5s
+
+    def _known(self, serial):
+        with self._lock:
+            return dict(self._device_md5.get(serial, {}))
+
+    def _remember(self, serial, md5s):
+        with self._lock:
+            self._device_md5.setdefault(serial, {}).update(md5s)
+
+    def push(self, artifacts, mode=None):
+        """
+        Push artifacts whose device copy is missing or differs
+
+        Args:
+            artifacts: list of (local path, device path) tuples
+            mode: optional mode to chmod pushed files with, e.g. 755
+
+        Raises:
+            AdbException: a push or the chmod failed, what is on the device is checked again by the next push
+
+        Returns:
+            list of device paths which have been pushed
+
+        """
+        serial = self.serial
+        known = self._known(serial)
+
+        local_md5s = {remote: self.local_md5(str(local)) for local, remote in artifacts}
+        unknown = [remote for remote, md5 in local_md5s.items() if known.get(remote) != md5]
+        if unknown:
+            known.update(self.device_md5(unknown))
+
+        pushed = []
+        failed = []
+        for local, remote in artifacts:
+            if known.get(remote) == local_md5s[remote]:
+                continue
+            self.adb.push_local_file(str(local), remote)
+            if self.adb.last_failed():
+                LOGGER.error('push {} failed: {}'.format(local, self.adb.get_error()))
+                failed.append(remote)
+                continue
+            pushed.append(remote)
+
+        # files found up to date on the device have not been pushed by this process, their mode is set as well
+        chmod = [remote for remote in unknown if remote not in failed]
+        if chmod and mode is not None:
+            self.adb.shell_command('chmod {} {}'.format(mode, ' '.join(chmod)))
+            if self.adb.last_failed():
+                raise AdbException('chmod {} {} failed: {}'.format(mode, ' '.join(chmod), self.adb.get_error()))
+
+        self._remember(serial, {remote: md5 for remote, md5 in local_md5s.items() if remote not in failed})
+        if failed:
+            raise AdbException('push failed: {}'.format(', '.join(failed)))
+        LOGGER.info('{} artifact(s) up to date, pushed: {}'.format(len(artifacts) - len(pushed), pushed))
+        return pushed
+
+    def is_apk_installed(self, apk_path, package):
+        """
+        Return True if the installed apk of the package is the same file as `apk_path`
+
+        """
+        serial = self.serial
+        key = 'package:{}'.format(package)
+        md5 = self.local_md5(str(apk_path))
+        if self._known(serial).get(key) == md5:
+            return True
+
+        # md5sum without a file (package not installed) would read stdin
+        outputs = self.adb.shell_command(
+            'p=$(pm path {} | head -n 1); [ -n "$p" ] && md5sum "${{p#package:}}" 2>/dev/null'.format(package))
+        installed = [m.group(1) for m in map(MD5SUM_PATTERN.match, outputs or []) if m]
+        if installed and installed[0] == md5:
+            self._remember(serial, {key: md5})
+            return True
+        return False
+
+    def forget_apk(self, package):
+        serial = self.serial
+        with self._lock:
+            self._device_md5.get(serial, {}).pop('package:{}'.format(package), None)
+
+    def invalidate(self):
+        """
+        Forget what is known to be on the device, the next push checks the device again
+        """
+        serial = self.serial
+        with self._lock:
+            self._device_md5.pop(serial, None)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import atexit
+import errno
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from logger import get_logger
+from minitest.core import settings
+from minitest.core.android.adb.exceptions import AdbException
+
+LOGGER = get_logger(__name__)
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        import ctypes
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _tcp_port(local):
+    return int(local[4:]) if local.startswith('tcp:') and local[4:].isdigit() else None
+
+
+@contextmanager
+def _file_lock(path, timeout=10.0):
+    """
+    Lock shared by the processes of the host: an OS lock on the file, released by the OS if the owner dies
+    """
+    deadline = time.time() + timeout
+    with open(path, 'a+') as f:
+        while True:
+            try:
+                if os.name == 'nt':
+                    import msvcrt
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN, errno.EDEADLK):
+                    raise
+            if time.time() > deadline:
+                raise AdbException('can not lock {}'.format(path))
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class PortAllocator(object):
+    """
+    Hand out local ports for adb forwards (`tcp:<port>` -> `localabstract:<service>_<port>`) without collisions
+    between the devices and the processes of the host.
+
+    The ports given out are recorded in a registry file next to a lock file, entries of dead processes are
+    dropped. A forward left by a previous run for the same device and service is reused instead of creating a
+    new one. `adb forward --list` is read at most once per settings.FORWARD_LIST_TTL for all devices, and the
+    forwards of this process are removed at exit.
+    """
+
+    def __init__(self, port_range=None, state_dir=None):
+        self.port_range = port_range or settings.FORWARD_PORT_RANGE
+        self.registry_path = os.path.join(state_dir or tempfile.gettempdir(), 'minitest_forward_ports.json')
+        self.lock_path = self.registry_path + '.lock'
+
+        self._owned = {}
+        self._forwards = None
+        self._forwards_time = 0
+        self._lock = threading.Lock()
+
+    def forwards(self, adb, refresh=False):
+        """
+        Return list of (serial, local, remote) tuples of all devices, read at most once per FORWARD_LIST_TTL
+        """
+        if refresh or self._forwards is None or time.time() - self._forwards_time > settings.FORWARD_LIST_TTL:
+            self._forwards = list(adb.forward_list() or [])
+            self._forwards_time = time.time()
+        return self._forwards
+
+    def _load(self):
+        try:
+            with open(self.registry_path) as f:
+                registry = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        return {port: entry for port, entry in registry.items() if _pid_alive(entry['pid'])}
+
+    def _save(self, registry):
+        tmp_path = '{}.{}'.format(self.registry_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(registry, f)
+        os.replace(tmp_path, self.registry_path)
+
+    @staticmethod
+    def _bindable(port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind(('127.0.0.1', port))
+            return True
+        except socket.error:
+            return False
+        finally:
+            sock.close()
+
+    def allocate(self, adb, service):
+        """
+        Forward a free local port to `localabstract:<service>_<port>` on the device of `adb`
+
+        Returns:
+            (local port, device socket name)
+
+        """
+        serial = adb.serial or adb.get_target_device()
+        prefix = 'localabstract:{}_'.format(service)
+
+        with self._lock, _file_lock(self.lock_path):
+            registry = self._load()
+            forwards = self.forwards(adb)
+
+            for forward_serial, local, remote in forwards:
+                port = _tcp_port(local)
+                if forward_serial == serial and remote.startswith(prefix) and port is not None \
+                        and str(port) not in registry and port not in self._owned:
+                    LOGGER.info('reuse forward {} -> {} of {}'.format(local, remote, serial))
+                    return self._register(registry, adb, serial, port, remote)
+
+            in_use = set(int(port) for port in registry) | set(self._owned) | \
+                set(_tcp_port(local) for _, local, _ in forwards)
+            start, end = self.port_range
+            candidates = list(range(start, end))
+            random.shuffle(candidates)
+            for port in candidates:
+                if port in in_use or not self._bindable(port):
+                    continue
+
+                remote = '{}{}'.format(prefix, port)
+                adb.forward_socket('tcp:{}'.format(port), remote)
+                if adb.last_failed():
+                    raise AdbException('forward tcp:{} {} failed: {}'.format(port, remote, adb.get_error()))
+                forwards.append((serial, 'tcp:{}'.format(port), remote))
+                return self._register(registry, adb, serial, port, remote)
+
+        raise AdbException('no free port in {}'.format(self.port_range))
+
+    def _register(self, registry, adb, serial, port, remote):
+        registry[str(port)] = {'pid': os.getpid(), 'serial': serial, 'remote': remote}
+        self._save(registry)
+        self._owned[port] = adb
+        return port, remote.split(':', 1)[1]
+
+    def release(self, port):
+        """
+        Remove the forward of the port and give the port back
+        """
+        with self._lock:
+            adb = self._owned.pop(port, None)
+            if adb is None:
+                return
+            adb.forward_remove('tcp:{}'.format(port))
+            if self._forwards is not None:
+                self._forwards = [f for f in self._forwards if f[1] != 'tcp:{}'.format(port)]
+            with _file_lock(self.lock_path):
+                registry = self._load()
+                registry.pop(str(port), None)
+                self._save(registry)
+
+    def release_all(self):
+        for port in list(self._owned):
+            try:
+                self.release(port)
+            except Exception as e:
+                LOGGER.warning('can not release port {}: {}'.format(port, e))
+
+
+_PORT_ALLOCATOR = None
+_PORT_ALLOCATOR_LOCK = threading.Lock()
+
+
+def get_port_allocator():
+    global _PORT_ALLOCATOR
+    with _PORT_ALLOCATOR_LOCK:
+        if _PORT_ALLOCATOR is None:
+            _PORT_ALLOCATOR = PortAllocator()
+            atexit.register(_PORT_ALLOCATOR.release_all)
+        return _PORT_ALLOCATOR
@@ -6,23 +6,46 @@
 
 import os
 import re
+import socket
 import subprocess
 import sys
 import threading
+from contextlib import closing
 
 from logger import get_logger
+from minitest.core import settings
 from minitest.core.android.adb import ADB_PATH
+from minitest.core.android.adb.adb_client import AdbClient
+from minitest.core.android.adb.exceptions import AdbException
 
 LOGGER = get_logger(__name__)
 
+# `[key]: [value]` lines of `adb shell getprop`, values may span several lines
+PROPERTY_PATTERN = re.compile(r'^\[([^\]]+)\]: \[(.*?)\]$', re.M | re.S)
+
+
+def _thread_result(name, default):
+    """
+    Per-thread attribute: the result of the last command is kept per thread so one ADB can be shared by
+    threads, e.g. by Android.prepare()
+    """
+
+    def get(self):
+        return getattr(self._results, name, default)
+
+    def set(self, value):
+        setattr(self._results, name, value)
+
+    return property(get, set)
+
 
 class ADB(object):
     PYADB_VERSION = "0.1.5"
 
     __adb_path = None
-    __output = None
-    __error = None
-    __return = 0
+    __output = _thread_result('output', None)
+    __error = _thread_result('error', None)
+    __return = _thread_result('return', 0)
     __devices = None
     __target = None
 
@@ -38,11 +61,22 @@ class ADB(object):
     def pyadb_version(self):
         return self.PYADB_VERSION
 
-    def __init__(self, adb_path=str(ADB_PATH), host=None, port=None, serial=None):
+    def __init__(self, adb_path=str(ADB_PATH), host=None, port=None, serial=None, native=None):
+        self._results = threading.local()
         self.__adb_path = adb_path
         self.host = host if host else '127.0.0.0'
         self.port = port if port else 5037
         self.serial = serial
+        # every command targets the given device, `-s <serial>`
+        self.__target = serial
+
+        # talk to the adb server directly instead of spawning the adb binary, see AdbClient
+        native = settings.ADB_NATIVE_CLIENT if native is None else native
+        self.client = AdbClient(self.host, self.port) if native else None
+
+        # device properties read by a single `getprop` dump, see get_properties
+        self._properties = None
+        self._properties_lock = threading.Lock()
 
         self._set_opt_cmd()
 
@@ -59,6 +93,30 @@ class ADB(object):
 
         return ret
 
+    def __set_result__(self, output, error=b'', returncode=0):
+        self.__output, self.__error, self.__return = output, error, returncode
+        try:
+            self.__output = self.__output.decode('utf-8')
+            self.__error = self.__error.decode('utf-8')
+        except UnicodeDecodeError:
+            # binary output (e.g. a jpg from minicap) is kept as bytes
+            return
+
+        if (len(self.__output) == 0):
+            self.__output = None
+        else:
+            self.__output = [x.strip() for x in self.__output.split('\n') if len(x.strip()) > 0]
+
+        if (len(self.__error) == 0):
+            self.__error = None
+
+    def __native_failed__(self, e):
+        LOGGER.warning('native adb client failed, fall back to adb binary: {}'.format(e))
+        self.__clean__()
+
+    def __serial__(self):
+        return self.__target or self.serial
+
     def __build_command__(self, cmd):
         ret = None
 
@@ -132,18 +190,8 @@ class ADB(object):
             adb_proc = subprocess.Popen(cmd_list, stdin=subprocess.PIPE, \
                                         stdout=subprocess.PIPE, \
                                         stderr=subprocess.PIPE, shell=False)
-            (self.__output, self.__error) = adb_proc.communicate()
-            self.__return = adb_proc.returncode
-            self.__output = self.__output.decode('utf-8')
-            self.__error = self.__error.decode('utf-8')
-
-            if (len(self.__output) == 0):
-                self.__output = None
-            else:
-                self.__output = [x.strip() for x in self.__output.split('\n') if len(x.strip()) > 0]
-
-            if (len(self.__error) == 0):
-                self.__error = None
+            (output, error) = adb_proc.communicate()
+            self.__set_result__(output, error, adb_proc.returncode)
 
         except:
             pass
@@ -342,18 +390,100 @@ class ADB(object):
         adb push local remote
         """
         self.__clean__()
+        if self.client is not None:
+            try:
+                pushed = self.client.push(local, remote, serial=self.__serial__())
+                self.__output = ['{}: 1 file pushed. {} bytes'.format(local, pushed)]
+                return self.__output
+            except (AdbException, socket.error, IOError) as e:
+                self.__native_failed__(e)
+
         self.run_cmd(['push', local, remote])
         return self.__output
 
     def shell_command(self, cmd):
         """
-        Executes a shell command
+        Executes a shell command, stderr and the exit code are only reported by devices with shell v2
+        (Android 7 and later), `last_failed` is never True for a shell command on older devices
         adb shell <cmd>
         """
         self.__clean__()
+        if self.client is not None:
+            try:
+                output, error, returncode = self.client.shell(cmd, serial=self.__serial__())
+                # an unknown exit code (no shell v2 on the device) counts as a success, like old adb binaries
+                self.__set_result__(output, error, returncode or 0)
+                return self.__output
+            except (AdbException, socket.error) as e:
+                self.__native_failed__(e)
+
         self.run_cmd(['shell', cmd])
         return self.__output
 
+    def shell_lines(self, cmd):
+        """
+        Executes a shell command and yields its output lines as they are produced.
+        Closing the generator (e.g. leaving the loop early) kills the remote command.
+        adb shell <cmd>
+        """
+        self.__clean__()
+        if self.client is not None:
+            try:
+                # no input, like AdbClient.shell
+                conn = self.client.open_service('shell:exec </dev/null; {}'.format(cmd), serial=self.__serial__())
+            except (AdbException, socket.error) as e:
+                self.__native_failed__(e)
+            else:
+                # adbd kills the command when its connection is closed
+                with conn, conn.socket.makefile('rb') as stream:
+                    for line in self.__iter_lines__(stream):
+                        yield line
+                return
+
+        adb_proc = self.shell_command_ext(cmd)
+        try:
+            for line in self.__iter_lines__(adb_proc.stdout):
+                yield line
+        finally:
+            if adb_proc.poll() is None:
+                adb_proc.kill()
+            adb_proc.wait()
+
+    @staticmethod
+    def __iter_lines__(stream):
+        for line in stream:
+            line = line.decode('utf-8', 'replace').strip()
+            if line:
+                yield line
+
+    def shell_search(self, cmd, predicate):
+        """
+        Executes a shell command and returns its first output line for which `predicate(line)` is True,
+        the command is killed as soon as it is found
+        """
+        with closing(self.shell_lines(cmd)) as lines:
+            for line in lines:
+                if predicate(line):
+                    return line
+        return None
+
+    def exec_out(self, cmd):
+        """
+        Executes a command without pty and returns its raw binary output
+        adb exec-out <cmd>
+        """
+        self.__clean__()
+        if self.client is not None:
+            try:
+                return self.client.exec_out(cmd, serial=self.__serial__())
+            except (AdbException, socket.error) as e:
+                self.__native_failed__(e)
+
+        adb_proc = self.run_cmd_ext(['exec-out', cmd])
+        output, self.__error = adb_proc.communicate()
+        self.__return = adb_proc.returncode
+        return output
+
     def listen_usb(self):
         """
         Restarts the adbd daemon listening on USB
@@ -458,9 +588,51 @@ class ADB(object):
         self.__clean__()
         if local is None or remote is None:
             return self.__output
+        if self.client is not None:
+            try:
+                self.client.forward(local, remote, serial=self.__serial__())
+                return self.__output
+            except (AdbException, socket.error) as e:
+                self.__native_failed__(e)
+
         self.run_cmd(['forward', local, remote])
         return self.__output
 
+    def forward_list(self):
+        """
+        List the forwards of all devices
+        adb forward --list
+
+        Returns:
+            list of (serial, local, remote) tuples
+
+        """
+        self.__clean__()
+        if self.client is not None:
+            try:
+                return self.client.forward_list()
+            except (AdbException, socket.error) as e:
+                self.__native_failed__(e)
+
+        self.run_cmd(['forward', '--list'])
+        return [tuple(line.split()[:3]) for line in self.__output or [] if len(line.split()) >= 3]
+
+    def forward_remove(self, local):
+        """
+        Remove a forward
+        adb forward --remove <local>
+        """
+        self.__clean__()
+        if self.client is not None:
+            try:
+                self.client.forward_remove(local, serial=self.__serial__())
+                return self.__output
+            except (AdbException, socket.error) as e:
+                self.__native_failed__(e)
+
+        self.run_cmd(['forward', '--remove', local])
+        return self.__output
+
     def uninstall(self, package=None, keepdata=False):
         """
         Remove this app package from the device
@@ -564,12 +736,10 @@ class ADB(object):
             None if no info has been found, otherwise package version
 
         """
-        outputs = self.shell_command('dumpsys package {}'.format(package))
-
-        for output in outputs:
-            matcher = re.search(r'versionCode=(\d+)', output)
-            if matcher:
-                return int(matcher.group(1))
+        pattern = re.compile(r'versionCode=(\d+)')
+        output = self.shell_search('dumpsys package {}'.format(package), pattern.search)
+        if output:
+            return int(pattern.search(output).group(1))
         return None
 
     def start_app(self, package, activity=None):
@@ -649,12 +819,10 @@ class ADB(object):
 
         if self.host not in ['localhost', '127.0.0.0']:
             self.opt_cmd += ['-H', self.host]
-            self.opt_cmd += ['-P', self.port]
-            self.opt_cmd += ['-s', self.serial]
+            self.opt_cmd += ['-P', str(self.port)]
 
     def wait_for_device_ext(self, timeout=5):
-        self.opt_cmd += ['wait-for-device']
-        proc = self.run_cmd_ext(self.opt_cmd)
+        proc = self.run_cmd_ext(self.opt_cmd + ['wait-for-device'])
         timer = threading.Timer(timeout, proc.kill)
         timer.start()
         ret = proc.wait()
@@ -705,7 +873,8 @@ class ADB(object):
              True if package has been found
 
          """
-        out = self.shell_command('dumpsys package {}'.format(package))
+        # any output is enough, no need to read the whole dump
+        out = self.shell_search('dumpsys package {}'.format(package), lambda line: True)
         if out:
             return True
         else:
@@ -743,22 +912,60 @@ class ADB(object):
     #
     #     proc.kill()
 
-    def getprop(self, key, strip):
+    def get_properties(self, refresh=False):
+        """
+         Perform a single `adb shell getprop` and parse every property of the device, the result is cached
+         until `invalidate_properties` is called (e.g. after a reboot). A failed or empty dump is not cached,
+         the next call dumps the properties again
+
+         Args:
+             refresh: True to dump the properties again
+
+         Returns:
+             dict of property key and value
+
+         """
+        with self._properties_lock:
+            if self._properties is not None and not refresh:
+                return self._properties
+
+            out = self.shell_command('getprop')
+            properties = dict(PROPERTY_PATTERN.findall('\n'.join(out or [])))
+            if properties:
+                self._properties = properties
+            else:
+                LOGGER.warning('getprop returned no property: {}'.format(self.get_error()))
+                self._properties = None
+            return properties
+
+    def invalidate_properties(self):
+        """
+        Drop the cached device properties, the next `getprop` dumps them again
+        """
+        with self._properties_lock:
+            self._properties = None
+
+    def getprop(self, key, strip=True, cached=True):
         """
          Perform `adb shell getprop` on the device
 
          Args:
              key: key value for property
              strip: True or False to strip the return carriage and line break from returned string
+             cached: True to read the property from the cached `getprop` dump, False to query the device
 
          Returns:
-             propery value
+             propery value, None if the property is not set
 
          """
-        out = self.shell_command('getprop {}'.format(key))
-        out = out[0]
-        if strip:
-            out.rstrip('\r\n')
+        if cached:
+            out = self.get_properties().get(key)
+        else:
+            out = self.shell_command('getprop {}'.format(key))
+            out = out[0] if out else None
+
+        if out is not None and strip:
+            out = out.rstrip('\r\n')
 
         return out
 
@@ -817,7 +1024,9 @@ class ADB(object):
             top activity as a tuple
 
         """
-        return self.shell_command('dumpsys activity top')
+        # only the first activity is the top one, stop reading the (possibly huge) dump there
+        out = self.shell_search('dumpsys activity top', lambda line: line.startswith('ACTIVITY '))
+        return [out] if out else None
 
     def get_input_method_info(self):
         """
@@ -5,15 +5,24 @@
 import time
 import re
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 
+from logger import get_logger
+from minitest.core import settings
 from minitest.core.android.adb.pyadb import ADB
+from minitest.core.android.device_query import DeviceQuery, DeviceState, prop_probe
 from minitest.core.android.ime.ime import YosemiteIme
 from minitest.core.android.minicap.minicap import Minicap
 from minitest.core.android.minitouch.minitouch import Minitouch
 from minitest.core.android.recorder.recorder import Recorder
-from minitest.core.cv2.img_utils import ImgUtils
+from minitest.core.android.rotation_watcher import RotationWatcher
 from minitest.core.device import Device
+from minitest.core.helper import reset_method_ready, ensure_method_ready
+from minitest.core.utils.screen_writer import write_screen
+
+LOGGER = get_logger(__name__)
 
 
 class Android(Device):
@@ -23,13 +32,60 @@ class Android(Device):
         self.adb = ADB(host=host, port=port, serial=serial)
         self.adb.wait_for_device_ext()
 
-        self.minicap = Minicap(self.adb)
-        self.minitouch = Minitouch(self.adb)
+        self.minicap = Minicap(self.adb, lambda: self.display_info)
+        self.minitouch = Minitouch(self.adb, lambda: self.display_info)
         self.ime = YosemiteIme(self.adb)
         self.recorder = Recorder(self.adb)
+        self.device_query = DeviceQuery(self.adb)
+        self.rotation_watcher = RotationWatcher(self.adb)
 
         self._display_info = {}
-        # self._current_orientation = None
+        self._state = {}
+
+    def prepare(self):
+        """
+        Set up everything the actions need instead of doing it lazily in the first action: install minicap and
+        read the display info, install and start minitouch, install or upgrade the IME. The stages run
+        concurrently. The IME is only enabled by the first `text`, the user's keyboard is left alone until then.
+
+        Raises:
+            the first exception raised by a stage, once all of them are done
+
+        Returns:
+            OrderedDict of stage name and the seconds it took, `total` included
+
+        """
+        timings = OrderedDict()
+
+        def timed(name, func):
+            start = time.time()
+            try:
+                return func()
+            finally:
+                timings[name] = time.time() - start
+
+        def minicap():
+            timed('minicap', lambda: ensure_method_ready(self.minicap, 'install'))
+            timed('display_info', lambda: self.display_info)
+
+        def minitouch():
+            timed('minitouch', lambda: ensure_method_ready(self.minitouch, 'install_and_set_up'))
+
+        def ime():
+            timed('ime', self.ime.install_or_upgrade)
+
+        start = time.time()
+        # the properties are needed by every stage, read them once up front
+        timed('properties', self.adb.get_properties)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(stage) for stage in (minicap, minitouch, ime)]
+        timings['total'] = time.time() - start
+
+        LOGGER.info('device prepared in {:.2f}s: {}'.format(
+            timings['total'], ', '.join('{} {:.2f}s'.format(k, v) for k, v in timings.items() if k != 'total')))
+        for future in futures:
+            future.result()
+        return timings
 
     def app_list(self, third_only=False):
         """
@@ -162,7 +218,7 @@ class Android(Device):
         if file_path:
             file_name = str(time.time()*1000) + '.jpg'
             file_path = os.path.join(file_path, file_name)
-            ImgUtils.imwrite(file_path, screen)
+            write_screen(file_path, screen)
 
         # '''t_img 需转换为cv2可解码的文件，不然会抛错 src is not a numpy array, neither a scalar'''
         # try:
@@ -175,6 +231,19 @@ class Android(Device):
 
         return screen
 
+    def wait_for_frame(self, timeout):
+        """
+        Wait until the screen may have changed since the last snapshot
+
+        Args:
+            timeout: maximum time to wait
+
+        Returns:
+            True if a new frame is available, False if the timeout expired (or the change can not be observed)
+
+        """
+        return self.minicap.wait_for_frame(timeout)
+
     def shell(self, cmd):
         return self.adb.shell_command(cmd)
 
@@ -229,8 +298,7 @@ class Android(Device):
             None
 
         """
-        # 根据屏幕方向，确定真正的点击位置，分四个方向
-        # pos = self._touch_point_by_orientation(pos)
+        # the position is mapped to the touch device according to the orientation, see Minitouch.get_transform
         self.minitouch.touch(pos, interval=interval)
 
     def double_click(self, pos):
@@ -238,28 +306,45 @@ class Android(Device):
         time.sleep(0.05)
         self.touch(pos)
 
-    def swipe(self, p1, p2, interval=0.5, steps=5):
+    def swipe(self, p1, p2, duration=0.5, steps=None, easing=None):
         """
         Perform swipe event on the device
 
         Args:
             p1: start point
             p2: end point
-            interval: how long to swipe the screen, default 0.5
-            steps: how big is the swipe step, default 5
+            duration: how long to swipe the screen, default 0.5
+            steps: how many moves, default is given by settings.SWIPE_RATE
+            easing: velocity profile, name in minitouch.gesture.EASINGS, default is settings.SWIPE_EASING
 
         Returns:
             None
 
         """
-        self.minitouch.swipe(p1, p2, interval=0.1, steps=steps)
+        self.minitouch.swipe(p1, p2, duration=duration, steps=steps, easing=easing)
+
+    def drag(self, p1, p2, duration=0.5, press=0.5):
+        """
+        Perform drag event on the device: press, move and stay on the end point so it does not fling
+
+        Args:
+            p1: start point
+            p2: end point
+            duration: how long to move, default 0.5
+            press: how long to press before moving, default 0.5
+
+        Returns:
+            None
+
+        """
+        self.minitouch.drag(p1, p2, duration=duration, press=press)
 
     def pinch(self, *args, **kwargs):
         """
         Perform pinch event on the device
 
         Args:
-            *args: optional arguments
+            *args: optional arguments, see Minitouch.pinch (center, from_radius, to_radius, fingers...)
             **kwargs: optional arguments
 
         Returns:
@@ -268,6 +353,35 @@ class Android(Device):
         """
         return self.minitouch.pinch(*args, **kwargs)
 
+    def rotate(self, *args, **kwargs):
+        """
+        Perform rotate event on the device
+
+        Args:
+            *args: optional arguments, see Minitouch.rotate (center, radius, degrees, fingers...)
+            **kwargs: optional arguments
+
+        Returns:
+            None
+
+        """
+        return self.minitouch.rotate(*args, **kwargs)
+
+    def multi_swipe(self, from_points, to_points, duration=0.5):
+        """
+        Perform swipe event with one finger per start and end point pair
+
+        Args:
+            from_points: start points
+            to_points: end points
+            duration: how long to swipe the screen, default 0.5
+
+        Returns:
+            None
+
+        """
+        return self.minitouch.multi_swipe(from_points, to_points, duration=duration)
+
     def logcat(self, *args, **kwargs):
         """
         Perform `logcat`operations
@@ -281,19 +395,30 @@ class Android(Device):
         """
         return self.adb.get_logcat(*args, **kwargs)
 
-    def getprop(self, key, strip=True):
+    def getprop(self, key, strip=True, cached=True):
         """
         Get properties for given key
 
         Args:
             key: key name
             strip: True or False whether to strip the output or not
+            cached: True or False whether to read from the cached property dump or query the device
 
         Returns:
             property value(s)
 
         """
-        return self.adb.getprop(key, strip)
+        return self.adb.getprop(key, strip, cached)
+
+    def invalidate_properties(self):
+        """
+        Drop the cached device properties, e.g. after the device has been rebooted
+
+        Returns:
+            None
+
+        """
+        self.adb.invalidate_properties()
 
     def get_ip_address(self):
         """
@@ -308,6 +433,54 @@ class Android(Device):
         """
         return self.adb.get_ip_address()
 
+    def query(self, *names, **probes):
+        """
+        Read several statuses with a single shell call, filtered on the device
+
+        Args:
+            *names: probe names, any of `top_activity`, `keyboard_shown`, `screen_on`, `locked`, `display_info`
+            **probes: extra Probe by name, e.g. props=prop_probe([...])
+
+        Returns:
+            dict of probe name and value, None when the value can not be read from the device
+
+        """
+        return self.device_query.query(*names, **probes)
+
+    def state(self, props=(), max_age=None):
+        """
+        Snapshot of the device state (screen on, locked, keyboard shown, top activity, display info and the
+        given properties) read with a single shell call. screen_on, locked and keyboard_shown are True or False,
+        None when the device does not report them. The display orientation is the rotation watcher's when it runs.
+
+        Args:
+            props: property keys to read, they are read from the device, not from the cached property dump
+            max_age: maximum age in seconds of a previous snapshot to return instead of querying the device,
+                default is settings.STATE_CACHE_TTL
+
+        Returns:
+            DeviceState
+
+        """
+        max_age = settings.STATE_CACHE_TTL if max_age is None else max_age
+        key = tuple(sorted(props))
+        cached = self._state.get(key)
+        if cached is not None and time.time() - cached.timestamp <= max_age:
+            return cached
+
+        timestamp = time.time()
+        probes = {'props': prop_probe(key)} if key else {}
+        values = self.query('screen_on', 'locked', 'keyboard_shown', 'top_activity', 'display_info', **probes)
+        state = DeviceState(screen_on=values['screen_on'],
+                            locked=values['locked'],
+                            keyboard_shown=values['keyboard_shown'],
+                            top_activity=values['top_activity'],
+                            display_info=self._with_orientation(values['display_info']) or self.display_info,
+                            props=values.get('props', {}),
+                            timestamp=timestamp)
+        self._state[key] = state
+        return state
+
     def get_top_activity(self):
         """
         Get the top activity
@@ -316,14 +489,7 @@ class Android(Device):
             package, activity and pid
 
         """
-        bat = self.adb.get_top_activity_info()
-        pattern = re.compile('\s*ACTIVITY ([A-Za-z0-9_.]+)/([A-Za-z0-9_.]+) \w+ pid=(\d+)')
-        out = pattern.search(str(bat))
-
-        if out:
-            return [out.group(1), out.group(2), out.group(3)]
-
-        return None
+        return self.query('top_activity')['top_activity']
 
     def is_keyboard_shown(self):
         """
@@ -336,11 +502,7 @@ class Android(Device):
             True or False
 
         """
-        out = self.adb.get_input_method_info()
-        if 'mInputShown=ture' in str(out):
-            return True
-        else:
-            return False
+        return bool(self.query('keyboard_shown')['keyboard_shown'])
 
     def is_screen_on(self):
         """
@@ -350,12 +512,10 @@ class Android(Device):
             Might not work on all devices
 
         Returns:
-            True or False
+            True or False, None if the device does not report it
 
         """
-        out = self.adb.get_window_policy_info()
-        pattern = re.compile('mScreenOnFully=(true|false)')
-        return pattern.search(str(out)).group(1)
+        return self.query('screen_on')['screen_on']
 
     def is_locked(self):
         """
@@ -365,17 +525,38 @@ class Android(Device):
             Might not work on some devices
 
         Returns:
-            True or False
+            True or False, None if the device does not report it
 
         """
-        out = self.adb.get_window_policy_info()
-
-        pattern = re.compile('mShowingLockscreen=(true|false)')
-        return pattern.search(str(out)).group(1)
+        return self.query('locked')['locked']
 
     def unlock(self):
         self.minicap.wake_up()
 
+    def invalidate(self):
+        """
+        Forget everything prepared on the device (installed binaries, running servers, cached properties and
+        display info), everything is set up again on the next call. Call it after the device has been rebooted.
+
+        Returns:
+            None
+
+        """
+        self.minicap.stop_stream()
+        self.minicap.enable_stream()
+        self.rotation_watcher.stop()
+        reset_method_ready(self.minicap, 'install')
+        self.minitouch.kill_client()
+        self.minitouch.kill_server()
+        reset_method_ready(self.ime, 'start')
+        reset_method_ready(self.recorder, 'start')
+        # what is known to be pushed is kept per serial, for minitouch as well
+        self.minicap.artifacts.invalidate()
+        self.ime.artifacts.forget_apk(self.ime.package_name)
+        self.adb.invalidate_properties()
+        self._display_info = {}
+        self._state = {}
+
     @property
     def display_info(self):
         """
@@ -385,15 +566,26 @@ class Android(Device):
             display information
 
         """
-        if not self._display_info:
+        watcher = self.rotation_watcher
+        if settings.ROTATION_WATCHER and watcher.supported and not watcher.is_alive():
+            # started with the first display info and restarted (with a delay) once its shell has ended,
+            # `minicap -i` is read again as the orientation is unknown until the watcher prints it
+            if watcher.start():
+                self._display_info = {}
+        if not self._display_info or not watcher.supported:
+            # without a watcher on the device, only a fresh `minicap -i` has the current orientation
             self._display_info = self.minicap.get_display_info()
-        display_info = copy(self._display_info)
-        # update ow orientation, which is more accurate
-        # if self._current_orientation is not None:
-        #     display_info.update({
-        #         "rotation": self._current_orientation * 90,
-        #         "orientation": self._current_orientation,
-        #     })
+        return self._with_orientation(self._display_info)
+
+    def _with_orientation(self, display_info):
+        # the orientation seen by the rotation watcher is current, the one of `minicap -i` may be cached
+        display_info = copy(display_info)
+        orientation = self.rotation_watcher.orientation
+        if display_info and orientation is not None:
+            display_info.update({
+                "rotation": orientation * 90,
+                "orientation": orientation,
+            })
         return display_info
 
     def get_display_info(self):
@@ -443,22 +635,3 @@ class Android(Device):
 
         """
         return self.recorder.stop_recording(*args, **kwargs)
-
-    # def _touch_point_by_orientation(self, tuple_xy):
-    #     """
-    #     Convert image coordinates to physical display coordinates, the arbitrary point (origin) is upper left corner
-    #     of the device physical display
-    #
-    #     Args:
-    #         tuple_xy: image coordinates (x, y)
-    #
-    #     Returns:
-    #
-    #     """
-    #     x, y = tuple_xy
-    #     x, y = XYTransformer.up_2_ori(
-    #         (x, y),
-    #         (self.display_info["width"], self.display_info["height"]),
-    #         self.display_info["orientation"]
-    #     )
-    #     return x, y
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import get_logger
+from minitest.core.android.adb.pyadb import ADB
+from minitest.core.android.android import Android
+from minitest.core.helper import bind_device
+
+LOGGER = get_logger(__name__)
+
+
+class DevicePool(object):
+    """
+    Several devices driven from one process.
+
+    The devices are enumerated with `adb devices` and set up in parallel. `run` calls a function once per
+    device, each call in its own thread with `G.DEVICE` bound to its device, so the module level api
+    (minitest.core.api) works unchanged in every thread.
+    """
+
+    def __init__(self, serials=None, host=None, port=None, max_workers=None):
+        self.host = host
+        self.port = port
+        self.serials = serials
+        self.max_workers = max_workers
+        self.devices = OrderedDict()
+
+    def list_serials(self):
+        error, serials = ADB(host=self.host, port=self.port).get_devices()
+        if error:
+            LOGGER.error('can not list devices: {}'.format(error))
+            return []
+        return serials or []
+
+    def connect(self):
+        """
+        Set up the devices (all connected ones by default) in parallel, the devices which fail are left out
+
+        Returns:
+            dict of serial and Android
+
+        """
+        serials = [s for s in (self.serials or self.list_serials()) if s not in self.devices]
+        if not serials:
+            return self.devices
+
+        def create(serial):
+            try:
+                return Android(host=self.host, port=self.port, serial=serial)
+            except Exception as e:
+                LOGGER.error('can not set up device {}: {}'.format(serial, e))
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(serials)) as executor:
+            for serial, device in zip(serials, executor.map(create, serials)):
+                if device is not None:
+                    self.devices[serial] = device
+
+        LOGGER.info('{} device(s) ready: {}'.format(len(self.devices), list(self.devices)))
+        return self.devices
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call `func(*args, **kwargs)` concurrently once per device, `G.DEVICE` being that device in the call
+
+        Returns:
+            dict of serial and the function result, or the exception it raised
+
+        """
+        devices = self.connect()
+        if not devices:
+            return {}
+
+        def call(device):
+            with bind_device(device):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    LOGGER.exception('{} failed on {}'.format(getattr(func, '__name__', func), device.adb.serial))
+                    return e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(devices)) as executor:
+            return OrderedDict(zip(devices, executor.map(call, devices.values())))
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __len__(self):
+        return len(self.devices)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import re
+from collections import namedtuple, OrderedDict
+
+from logger import get_logger
+
+LOGGER = get_logger(__name__)
+
+# a status read from the output of `source` filtered on the device by the `patterns` regex alternatives (the whole
+# output when None), `parser` turns the lines into the value, `first_only` stops the source at the first matching line
+Probe = namedtuple('Probe', ['source', 'patterns', 'parser', 'first_only'])
+
+# snapshot returned by Android.state(), `timestamp` is the time.time() the device has been queried at, the flags
+# (screen_on, locked, keyboard_shown) are None when the device does not report them
+DeviceState = namedtuple('DeviceState', ['screen_on', 'locked', 'keyboard_shown', 'top_activity', 'display_info',
+                                         'props', 'timestamp'])
+
+SECTION_MARKER = '##minitest-query:{}##'
+SECTION_PATTERN = re.compile(r'^##minitest-query:(\d+)##$')
+
+
+def _parse_top_activity(lines):
+    pattern = re.compile(r'\s*ACTIVITY ([A-Za-z0-9_.$]+)/([A-Za-z0-9_.$]+) \w+ pid=(\d+)')
+    for line in lines:
+        out = pattern.search(line)
+        if out:
+            return [out.group(1), out.group(2), out.group(3)]
+    return None
+
+
+def _parse_flag(*patterns):
+    """
+    Parser returning True/False from the first line matching one of `patterns` (whose group is the value),
+    None if no line matches
+    """
+    patterns = [(re.compile(p), true_value) for p, true_value in patterns]
+
+    def parse(lines):
+        for line in lines:
+            for pattern, true_value in patterns:
+                m = pattern.search(line)
+                if m:
+                    return m.group(1) == true_value
+        return None
+
+    return parse
+
+
+def _parse_json(lines):
+    try:
+        return json.loads(''.join(lines))
+    except ValueError:
+        return None
+
+
+def prop_probe(keys):
+    """
+    Probe reading the given properties from `getprop`
+
+    Returns:
+        the probe, its value is the dict of property key and value, missing keys are left out
+
+    """
+    pattern = re.compile(r'^\[([^\]]+)\]: \[(.*)\]$')
+
+    def parse(lines):
+        props = {}
+        for line in lines:
+            m = pattern.match(line.strip())
+            if m and m.group(1) in keys:
+                props[m.group(1)] = m.group(2)
+        return props
+
+    return Probe('getprop', [r'^\[{}\]'.format(re.escape(key)) for key in keys], parse, False)
+
+
+PROBES = {
+    'top_activity': Probe('dumpsys activity top', ['ACTIVITY '], _parse_top_activity, True),
+    'keyboard_shown': Probe('dumpsys input_method', ['mInputShown='],
+                            _parse_flag((r'mInputShown=(true|false)', 'true')), False),
+    'screen_on': Probe('dumpsys window policy', ['mScreenOnFully=', 'screenState='],
+                       _parse_flag((r'mScreenOnFully=(true|false)', 'true'),
+                                   (r'screenState=(SCREEN_STATE_\w+)', 'SCREEN_STATE_ON')), False),
+    'locked': Probe('dumpsys window policy', ['mShowingLockscreen=', 'isStatusBarKeyguard='],
+                    _parse_flag((r'mShowingLockscreen=(true|false)', 'true'),
+                                (r'isStatusBarKeyguard=(true|false)', 'true')), False),
+    'display_info': Probe('LD_LIBRARY_PATH=/data/local/tmp /data/local/tmp/minicap -i 2>/dev/null', None,
+                          _parse_json, False),
+}
+
+
+class DeviceQuery(object):
+    """
+    Read several device statuses with one shell round trip.
+
+    Probes sharing a source (e.g. `dumpsys window policy`) run it once with their filters merged, the filtering
+    happens on the device with grep so only the few relevant lines are sent back, and every source output is
+    delimited by a marker line so each probe parses its own section.
+    """
+
+    def __init__(self, adb, probes=None):
+        self.adb = adb
+        self.probes = PROBES if probes is None else probes
+
+    @staticmethod
+    def build_script(probes):
+        """
+        Args:
+            probes: list of Probe
+
+        Returns:
+            (shell script, list of the sources in the order of their sections)
+
+        """
+        sources = OrderedDict()
+        for probe in probes:
+            patterns, first_only = sources.get(probe.source, ([], True))
+            if patterns is not None:
+                patterns = None if probe.patterns is None else \
+                    patterns + [p for p in probe.patterns if p not in patterns]
+            sources[probe.source] = (patterns, first_only and probe.first_only)
+
+        commands = []
+        for index, (source, (patterns, first_only)) in enumerate(sources.items()):
+            command = "echo '{}'; {}".format(SECTION_MARKER.format(index), source)
+            if patterns is not None:
+                command += " | grep {}-E '{}'".format('-m 1 ' if first_only else '', '|'.join(patterns))
+            commands.append(command)
+        return '; '.join(commands), list(sources)
+
+    def query(self, *names, **probes):
+        """
+        Run the probes in a single shell call
+
+        Args:
+            *names: names of the registered probes
+            **probes: extra Probe by name, e.g. props=prop_probe([...])
+
+        Returns:
+            dict of probe name and value
+
+        """
+        probes = OrderedDict([(name, self.probes[name]) for name in names] + sorted(probes.items()))
+        script, sources = self.build_script(list(probes.values()))
+        outputs = self.adb.shell_command(script) or []
+
+        sections = {}
+        current = None
+        for line in outputs:
+            m = SECTION_PATTERN.match(line)
+            if m:
+                current = sources[int(m.group(1))]
+                sections[current] = []
+            elif current is not None:
+                sections[current].append(line)
+
+        return {name: probe.parser(sections.get(probe.source, [])) for name, probe in probes.items()}
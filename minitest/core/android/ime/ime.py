@@ -4,9 +4,10 @@ import re
 
 from pyaxmlparser import APK
 
+from minitest.core.android.adb.artifact_sync import ArtifactSync
 from minitest.core.android.ime import *
 from minitest.core.android.ime.exceptions import ImeException
-from minitest.core.helper import on_method_ready
+from minitest.core.helper import on_method_ready, reset_method_ready
 from minitest.core.utils.codec import unicode
 
 
@@ -15,19 +16,24 @@ class Ime(object):
         self.adb = adb
         self.apk_path = apk_path
         self.service_name = service_name
-
-        def get_default_ime(adb):
-            outputs = adb.shell_command("settings get secure default_input_method")
-
-            ime = outputs[0] if len(outputs) == 1 else None
-            return ime
+        self.artifacts = ArtifactSync(adb)
 
         def get_package_name(service_name):
             return service_name.split('/')[0]
 
-        self.default_ime = get_default_ime(self.adb)
+        self._default_ime = None
         self.package_name = get_package_name(self.service_name)
 
+    @property
+    def default_ime(self):
+        """
+        The IME which was the default one, read from the device on first use
+        """
+        if self._default_ime is None:
+            outputs = self.adb.shell_command("settings get secure default_input_method") or []
+            self._default_ime = outputs[0] if len(outputs) == 1 else ''
+        return self._default_ime or None
+
     def __enter__(self):
         self.start()
 
@@ -54,6 +60,7 @@ class Ime(object):
         if self.default_ime and self.default_ime != self.service_name:
             self.adb.shell_command("ime disable {}".format(self.service_name))
             self.adb.shell_command("ime set {}".format(self.default_ime))
+        reset_method_ready(self, 'start')
 
     def is_default(self):
         if self.default_ime and self.default_ime != self.service_name:
@@ -65,6 +72,8 @@ class Ime(object):
 
     def uninstall(self):
         self.adb.uninstall(self.package_name)
+        self.artifacts.forget_apk(self.package_name)
+        reset_method_ready(self, 'start')
 
     def text(self, value):
         raise NotImplementedError
@@ -74,15 +83,22 @@ class YosemiteIme(Ime):
     def __init__(self, adb):
         super(YosemiteIme, self).__init__(adb, YOSEMITE_APK_PATH, YOSEMITE_IME_SERVICE_NAME)
 
-    def start(self):
-        def install_or_upgrade(adb, apk_path, service_name):
-            installed_version_code = adb.get_package_version(service_name)
-            apk_version_code = APK(apk_path).version_code
+    def install_or_upgrade(self):
+        """
+        Install the apk when it is missing or older than the local one, the IME is not enabled
+        """
+        # the very same apk is already installed, no need to read versions
+        if self.artifacts.is_apk_installed(self.apk_path, self.package_name):
+            return
+
+        installed_version_code = self.adb.get_package_version(self.service_name)
+        apk_version_code = APK(self.apk_path).version_code
 
-            if installed_version_code is None or int(apk_version_code) > int(installed_version_code):
-                self.install()
+        if installed_version_code is None or int(apk_version_code) > int(installed_version_code):
+            self.install()
 
-        install_or_upgrade(self.adb, self.apk_path, self.service_name)
+    def start(self):
+        self.install_or_upgrade()
         super(YosemiteIme, self).start()
 
     def stop(self):
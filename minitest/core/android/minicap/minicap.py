@@ -1,19 +1,43 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import json
+import socket
+import struct
+import threading
+import time
+from collections import deque
 from pathlib import Path
 
+from retry import retry
+
 from logger import get_logger
+from minitest.core import settings
+from minitest.core.android.adb.artifact_sync import ArtifactSync
+from minitest.core.android.adb.port_allocator import get_port_allocator
 from minitest.core.android.minicap import MINICAP_PATH, MINICAP_SHARED_PATH
-from minitest.core.helper import on_method_ready, logwrap
+from minitest.core.android.minicap.exceptions import MinicapException
+from minitest.core.helper import on_method_ready, logwrap, reset_method_ready
 
 LOGGER = get_logger(__name__)
 
 
 class Minicap(object):
-    def __init__(self, adb):
+    def __init__(self, adb, get_display_info=None):
+        """
+        Args:
+            adb: ADB
+            get_display_info: function returning the current display info, e.g. kept current by a rotation
+                watcher, `minicap -i` is run for every one-shot screenshot without it
+
+        """
         self.adb = adb
+        self._get_display_info = get_display_info
         self.dir = '/data/local/tmp'
+        self.artifacts = ArtifactSync(adb)
+
+        self.stream = None
+        # set once the stream has failed, screenshots are one-shot until enable_stream (uninstall, invalidate)
+        self.stream_disabled = False
 
     @on_method_ready('install')
     @logwrap(LOGGER)
@@ -24,27 +48,32 @@ class Minicap(object):
             self.adb.shell_command('input swipe 500 700 500 50')
 
     def install(self):
-        abi = self.adb.shell_command('getprop ro.product.cpu.abi')[0]
-        pre_sdk_version = int(self.adb.shell_command("getprop ro.build.version.preview_sdk")[0])
-        sdk_version = int(self.adb.shell_command('getprop ro.build.version.sdk')[0])
-        rel_version = int(self.adb.shell_command('getprop ro.build.version.release')[0].split('.')[0])
+        abi = self.adb.getprop('ro.product.cpu.abi')
+        pre_sdk_version = int(self.adb.getprop('ro.build.version.preview_sdk') or 0)
+        sdk_version = int(self.adb.getprop('ro.build.version.sdk'))
+        rel_version = int(self.adb.getprop('ro.build.version.release').split('.')[0])
 
         sdk_version = sdk_version + 1 if pre_sdk_version > 0 else sdk_version
         minicap_bin = 'minicap' if sdk_version >= 16 else 'minicap-nopie'
 
         minicap_bin_path = Path.joinpath(MINICAP_PATH, abi, minicap_bin)
-        self.adb.push_local_file(str(minicap_bin_path), '{}/minicap'.format(self.dir))
-        self.adb.shell_command('chmod 755 {}/minicap'.format(self.dir))
 
         minicap_so_path = Path.joinpath(MINICAP_SHARED_PATH, 'android-{}/{}/minicap.so'.format(rel_version, abi))
         if minicap_so_path.exists() is False:
             minicap_so_path = Path.joinpath(MINICAP_SHARED_PATH, 'android-{}/{}/minicap.so'.format(sdk_version, abi))
-        self.adb.push_local_file(str(minicap_so_path), '{}/minicap.so'.format(self.dir))
-        self.adb.shell_command('chmod 755 {}/minicap.so'.format(self.dir))
+
+        self.artifacts.push([
+            (minicap_bin_path, '{}/minicap'.format(self.dir)),
+            (minicap_so_path, '{}/minicap.so'.format(self.dir)),
+        ], mode=755)
 
     @logwrap(LOGGER)
     def uninstall(self):
+        self.stop_stream()
         self.adb.shell_command('rm -rf {}/minicap*'.format(self.dir))
+        self.artifacts.invalidate()
+        reset_method_ready(self, 'install')
+        self.enable_stream()
 
     @on_method_ready('install')
     @logwrap(LOGGER)
@@ -57,14 +86,244 @@ class Minicap(object):
     @on_method_ready('install')
     @logwrap(LOGGER)
     def get_frame(self):
-        display_info = self.get_display_info()
+        if settings.MINICAP_STREAM and not self.stream_disabled:
+            try:
+                return self.get_stream_frame()
+            except (MinicapException, RuntimeError, socket.error) as e:
+                # fall back to the one-shot screenshot below, without trying the stream again every frame
+                LOGGER.warning('minicap stream is not available, one-shot screenshots from now on: {}'.format(e))
+                self.stop_stream()
+                self.stream_disabled = True
+
+        display_info = self.current_display_info()
         width = display_info['width']
         height = display_info['height']
         rotation = display_info['rotation']
 
-        frame = self.adb.shell_command('LD_LIBRARY_PATH=/data/local/tmp /data/local/tmp/minicap -P {}x{}@{}x{}/{} -s'
-                                       .format(width, height, width, height, rotation))
+        cmd = 'LD_LIBRARY_PATH=/data/local/tmp /data/local/tmp/minicap -P {}x{}@{}x{}/{} -s 2>/dev/null'.format(
+            width, height, width, height, rotation)
+        if int(self.adb.getprop('ro.build.version.sdk')) >= 21:
+            # exec-out keeps the jpg bytes untouched
+            return self.adb.exec_out(cmd)
+
+        frame = self.adb.shell_command(cmd)
         # jpg_data = frame.split(b"for JPG encoder" + b"\r\n")[-1]
         jpg_data = frame.replace(b"\r\n", b"\n")
         return jpg_data
 
+    def enable_stream(self):
+        """
+        Try the stream again on the next frame after it has failed
+        """
+        self.stream_disabled = False
+
+    def current_display_info(self):
+        if self._get_display_info is not None:
+            return self._get_display_info()
+        return self.get_display_info()
+
+    def start_stream(self):
+        # the projection of a running stream is fixed, it is restarted when the display has been rotated
+        display_info = self._get_display_info() if self._get_display_info is not None else None
+        if self.stream is not None and self.stream.is_alive():
+            if display_info is None or display_info['rotation'] == self.stream.display_info['rotation']:
+                return self.stream
+
+        self.stop_stream()
+        self.stream = MinicapStream(self.adb, self.dir, display_info or self.get_display_info())
+        self.stream.start()
+        return self.stream
+
+    def stop_stream(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream = None
+
+    def get_stream_frame(self, timeout=5.0):
+        """
+        Return the latest jpg frame from the minicap stream, starting the stream if needed
+
+        Args:
+            timeout: how long to wait for the first frame
+
+        Returns:
+            jpg data
+
+        """
+        return self.start_stream().get_frame(timeout=timeout)
+
+    def wait_for_frame(self, timeout):
+        """
+        Wait until minicap sends a frame newer than the last one read, minicap only sends frames when the
+        screen changes. Without a running stream it just sleeps.
+
+        Returns:
+            True if a new frame is available
+
+        """
+        stream = self.stream
+        if stream is None or not stream.is_alive():
+            time.sleep(timeout)
+            return False
+        return stream.wait_for_frame(timeout)
+
+
+class MinicapStream(object):
+    """
+    Long-lived minicap server whose frames are read from a forwarded localabstract socket.
+
+    https://github.com/openstf/minicap#usage
+
+    The socket sends a 24 bytes global header (banner) once, then every frame as a 4 bytes little endian
+    length followed by the jpg data. The latest frames are kept in a ring buffer.
+    """
+
+    BANNER_FORMAT = '<BBIIIIIBB'
+    BANNER_SIZE = struct.calcsize(BANNER_FORMAT)
+
+    def __init__(self, adb, dir, display_info, buffer_size=None):
+        self.adb = adb
+        self.dir = dir
+        self.display_info = display_info
+
+        self.local_port = None
+        self.device_port = None
+        self.server_process = None
+        self.socket = None
+        self.banner = None
+
+        self.frames = deque(maxlen=buffer_size or settings.MINICAP_STREAM_BUFFER_SIZE)
+        self.frame_seq = 0
+        self.read_seq = 0
+        self._frame_cond = threading.Condition()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        width = self.display_info['width']
+        height = self.display_info['height']
+        rotation = self.display_info['rotation']
+
+        self.local_port, self.device_port = get_port_allocator().allocate(self.adb, 'minicap')
+
+        self.server_process = self.adb.shell_command_ext(
+            'LD_LIBRARY_PATH={0} {0}/minicap -n {1} -P {2}x{3}@{2}x{3}/{4} 2>&1'.format(
+                self.dir, self.device_port, width, height, rotation))
+
+        self.socket = self._connect()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._read_frames, name='minicap-stream-{}'.format(self.local_port))
+        self._thread.daemon = True
+        self._thread.start()
+
+    @retry(exceptions=MinicapException, tries=20, delay=0.2)
+    def _connect(self):
+        if self.server_process.poll() is not None:
+            raise RuntimeError('minicap server quit immediately')
+
+        try:
+            sock = socket.create_connection(('localhost', self.local_port), timeout=5.0)
+        except socket.error:
+            raise MinicapException('can not connect to localhost:{}'.format(self.local_port))
+
+        try:
+            # adb accepts the connection before minicap listens, an empty banner means "not ready yet"
+            self.banner = self._parse_banner(self._recv_exactly(sock, self.BANNER_SIZE))
+        except (MinicapException, socket.error):
+            sock.close()
+            raise MinicapException('minicap server is not ready')
+        sock.settimeout(None)
+
+        LOGGER.info('minicap stream banner: {}'.format(self.banner))
+        return sock
+
+    @classmethod
+    def _parse_banner(cls, data):
+        version, length, pid, real_width, real_height, virtual_width, virtual_height, orientation, quirks = \
+            struct.unpack(cls.BANNER_FORMAT, data)
+        if length != cls.BANNER_SIZE:
+            raise MinicapException('unexpected minicap banner length: {}'.format(length))
+
+        return {
+            'version': version,
+            'pid': pid,
+            'real_width': real_width,
+            'real_height': real_height,
+            'virtual_width': virtual_width,
+            'virtual_height': virtual_height,
+            'orientation': orientation * 90,
+            'quirks': quirks,
+        }
+
+    @staticmethod
+    def _recv_exactly(sock, size, buf=None):
+        buf = bytearray(size) if buf is None else buf
+        view = memoryview(buf)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:], size - received)
+            if n == 0:
+                raise MinicapException('minicap socket closed')
+            received += n
+        return buf
+
+    def _read_frames(self):
+        header = bytearray(4)
+        try:
+            while not self._stopped.is_set():
+                frame_size, = struct.unpack('<I', self._recv_exactly(self.socket, 4, header))
+                # received in place, the buffer is handed out as is since frames are kept in the ring buffer
+                frame = self._recv_exactly(self.socket, frame_size)
+
+                with self._frame_cond:
+                    self.frame_seq += 1
+                    self.frames.append((self.frame_seq, time.time(), frame))
+                    self._frame_cond.notify_all()
+        except (MinicapException, socket.error) as e:
+            if not self._stopped.is_set():
+                LOGGER.warning('minicap stream stopped: {}'.format(e))
+        finally:
+            self._stopped.set()
+            with self._frame_cond:
+                self._frame_cond.notify_all()
+
+    def is_alive(self):
+        return self._thread is not None and not self._stopped.is_set()
+
+    def get_frame(self, timeout=5.0):
+        """
+        Return the latest jpg frame, waiting up to `timeout` seconds for the first one
+
+        """
+        with self._frame_cond:
+            if not self.frames:
+                self._frame_cond.wait_for(lambda: self.frames or self._stopped.is_set(), timeout=timeout)
+            if not self.frames:
+                raise MinicapException('no frame received from minicap stream')
+            self.read_seq, _, frame = self.frames[-1]
+            return frame
+
+    def wait_for_frame(self, timeout):
+        """
+        Wait up to `timeout` seconds for a frame newer than the last one returned by get_frame
+
+        """
+        with self._frame_cond:
+            return self._frame_cond.wait_for(lambda: self.frame_seq > self.read_seq or self._stopped.is_set(),
+                                             timeout=timeout) and self.frame_seq > self.read_seq
+
+    def stop(self):
+        self._stopped.set()
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.socket.close()
+            self.socket = None
+        if self.server_process is not None:
+            self.server_process.kill()
+            self.server_process = None
+        if self.local_port is not None:
+            get_port_allocator().release(self.local_port)
+            self.local_port = None
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+# progress (0..1) of the elapsed time -> progress (0..1) of the path
+EASINGS = {
+    'linear': lambda t: t,
+    'ease_in': lambda t: t * t,
+    'ease_out': lambda t: t * (2 - t),
+    'ease_in_out': lambda t: 2 * t * t if t < 0.5 else 1 - 2 * (1 - t) * (1 - t),
+    'ease_out_cubic': lambda t: 1 - (1 - t) ** 3,
+}
+
+
+def linear_path(from_xy, to_xy):
+    (from_x, from_y), (to_x, to_y) = from_xy, to_xy
+    return lambda p: (from_x + (to_x - from_x) * p, from_y + (to_y - from_y) * p)
+
+
+def arc_path(center, from_radius, to_radius, from_angle, to_angle):
+    """
+    Path around `center` whose radius and angle (degrees) change together, a spiral in general
+    """
+    cx, cy = center
+
+    def path(p):
+        radius = from_radius + (to_radius - from_radius) * p
+        angle = math.radians(from_angle + (to_angle - from_angle) * p)
+        return cx + radius * math.cos(angle), cy + radius * math.sin(angle)
+
+    return path
+
+
+class Gesture(object):
+    """
+    Compile a whole gesture into one minitouch command buffer, sent with a single write by `Minitouch.perform`.
+
+    https://github.com/openstf/minitouch
+
+    The pauses are `w <ms>` commands executed by minitouch itself, so the timing does not depend on the host
+    (no sleep jitter, no syscall per step). Every method returns the gesture so calls can be chained:
+
+        Gesture().down(0, 10, 10).commit().wait(100).up(0).commit()
+
+    Positions are kept as given (screen pixels) until `to_bytes`, which maps all of them to the touch device
+    at once with the transform of the current rotation, see transform.TouchTransform.
+    """
+
+    def __init__(self, pressure=50):
+        self.pressure = pressure
+        self.commands = []
+        self.duration = 0
+        self.contacts = set()
+
+    def down(self, contact, x, y, pressure=None):
+        self.contacts.add(contact)
+        self.commands.append(('d', contact, x, y, self.pressure if pressure is None else pressure))
+        return self
+
+    def move(self, contact, x, y, pressure=None):
+        self.commands.append(('m', contact, x, y, self.pressure if pressure is None else pressure))
+        return self
+
+    def up(self, contact):
+        self.commands.append(('u', contact))
+        return self
+
+    def commit(self):
+        self.commands.append(('c',))
+        return self
+
+    def reset(self):
+        self.commands.append(('r',))
+        return self
+
+    def wait(self, ms):
+        """
+        Pause for `ms` milliseconds on the device, pauses shorter than 1ms are dropped
+        """
+        ms = int(round(ms))
+        if ms > 0:
+            self.commands.append(('w', ms))
+            self.duration += ms
+        return self
+
+    def tap(self, x, y, duration=10, contact=0):
+        """
+        Touch (x, y) for `duration` milliseconds
+        """
+        return self.down(contact, x, y).commit().wait(duration).up(contact).commit()
+
+    def animate(self, paths, duration, rate=100, easing='linear', steps=None, press=0):
+        """
+        Move contacts along paths in lockstep: all of them go down at the start of their path and move once
+        per frame (one commit per frame), they stay down at the end
+
+        Args:
+            paths: dict of contact and function returning the (x, y) position at a path progress (0..1)
+            duration: milliseconds from the first to the last position
+            rate: frames per second
+            easing: name in EASINGS or function mapping the time progress to the path progress
+            steps: number of frames, overrides `rate`
+            press: milliseconds to stay down at the start before moving
+
+        """
+        ease = EASINGS[easing] if isinstance(easing, str) else easing
+        steps = max(1, int(steps or round(duration / 1000.0 * rate)))
+
+        for contact, path in sorted(paths.items()):
+            self.down(contact, *path(0))
+        self.commit().wait(press)
+
+        elapsed = 0
+        for i in range(1, steps + 1):
+            # waits are rounded to 1ms, keep them aligned to the frame times so the total is `duration`
+            frame_time = int(round(duration * i / float(steps)))
+            self.wait(frame_time - elapsed)
+            elapsed = frame_time
+
+            progress = ease(i / float(steps))
+            for contact, path in sorted(paths.items()):
+                self.move(contact, *path(progress))
+            self.commit()
+        return self
+
+    def swipe(self, from_xy, to_xy, duration=300, rate=100, easing='linear', steps=None, contact=0,
+              press=0, hold=0):
+        """
+        Swipe from `from_xy` to `to_xy` in `duration` milliseconds
+
+        Args:
+            press: milliseconds to stay down at `from_xy` before moving, e.g. to drag an item
+            hold: milliseconds to stay down at `to_xy` before lifting, no fling with a hold
+
+        """
+        self.animate({contact: linear_path(from_xy, to_xy)}, duration, rate, easing, steps, press)
+        return self._release([contact], hold)
+
+    def multi_swipe(self, from_xys, to_xys, duration=300, rate=100, easing='linear', steps=None, press=0,
+                    hold=0):
+        """
+        Swipe with one finger per (from, to) pair, all fingers move together
+        """
+        paths = {contact: linear_path(from_xy, to_xy) for contact, (from_xy, to_xy) in enumerate(zip(from_xys, to_xys))}
+        self.animate(paths, duration, rate, easing, steps, press)
+        return self._release(paths, hold)
+
+    def pinch(self, center, from_radius, to_radius, fingers=2, angle=0, duration=300, rate=100,
+              easing='ease_in_out', steps=None, hold=0):
+        """
+        Fingers evenly spread on a circle around `center` move from `from_radius` to `to_radius`:
+        zoom in when the radius grows, zoom out when it shrinks
+
+        Args:
+            angle: degrees of the first finger, 0 is on the right of the center
+            hold: milliseconds to stay down at the end, no fling with a hold
+
+        """
+        return self.rotate(center, from_radius, 0, fingers, angle, duration, rate, easing, steps, hold,
+                           to_radius=to_radius)
+
+    def rotate(self, center, radius, degrees, fingers=2, angle=0, duration=300, rate=100, easing='ease_in_out',
+               steps=None, hold=0, to_radius=None):
+        """
+        Fingers evenly spread on a circle around `center` turn by `degrees` (clockwise on the screen), the
+        radius optionally changes to `to_radius` on the way
+        """
+        to_radius = radius if to_radius is None else to_radius
+        paths = {}
+        for contact in range(fingers):
+            start = angle + 360.0 * contact / fingers
+            paths[contact] = arc_path(center, radius, to_radius, start, start + degrees)
+        self.animate(paths, duration, rate, easing, steps)
+        return self._release(paths, hold)
+
+    def _release(self, contacts, hold):
+        self.wait(hold)
+        for contact in sorted(contacts):
+            self.up(contact)
+        return self.commit()
+
+    def extend(self, gesture):
+        self.commands.extend(gesture.commands)
+        self.duration += gesture.duration
+        self.contacts.update(gesture.contacts)
+        return self
+
+    def to_lines(self, transform=None):
+        """
+        Args:
+            transform: optional function mapping an (N, 2) array of positions to touch device positions
+
+        Returns:
+            list of minitouch commands
+        """
+        points = np.array([cmd[2:4] for cmd in self.commands if cmd[0] in 'dm'], dtype=np.float64).reshape(-1, 2)
+        if transform is not None and len(points):
+            points = transform(points)
+        points = iter(np.rint(points).astype(int).tolist())
+
+        lines = []
+        for cmd in self.commands:
+            if cmd[0] in 'dm':
+                x, y = next(points)
+                lines.append('{} {} {} {} {}'.format(cmd[0], cmd[1], x, y, cmd[4]))
+            else:
+                lines.append(' '.join(str(arg) for arg in cmd))
+        return lines
+
+    def to_bytes(self, transform=None):
+        return ''.join(line + '\n' for line in self.to_lines(transform)).encode('ascii')
+
+    def __repr__(self):
+        return 'Gesture({})'.format('; '.join(self.to_lines()))
+
+    def __len__(self):
+        return len(self.commands)
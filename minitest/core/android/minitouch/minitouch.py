@@ -1,17 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import random
 import re
+import select
 import socket
 import time
 from pathlib import Path
 
-from retry import retry
-
 from logger import get_logger
+from minitest.core import settings
+from minitest.core.android.adb.artifact_sync import ArtifactSync
+from minitest.core.android.adb.port_allocator import get_port_allocator
 from minitest.core.android.minitouch import MINITOUCH_PATH
 from minitest.core.android.minitouch.exceptions import MinitouchException
-from minitest.core.helper import on_method_ready, logwrap
+from minitest.core.android.minitouch.gesture import Gesture
+from minitest.core.android.minitouch.transform import get_touch_transform
+from minitest.core.helper import on_method_ready, logwrap, reset_method_ready, settle
 from minitest.core.utils.non_blocking_stream_reader import NonBlockingStreamReader
 from minitest.core.utils.simple_socket import *
 
@@ -19,9 +22,18 @@ LOGGER = get_logger(__name__)
 
 
 class Minitouch(object):
-    def __init__(self, adb):
+    def __init__(self, adb, get_display_info=None):
+        """
+        Args:
+            adb: ADB
+            get_display_info: function returning the current display info (width, height, rotation), positions
+                are then mapped to the touch device, see get_transform. Positions are sent as given without it.
+
+        """
         self.adb = adb
+        self.get_display_info = get_display_info
         self.dir = '/data/local/tmp'
+        self.artifacts = ArtifactSync(adb)
 
         self.local_port = None
         self.device_port = None
@@ -29,21 +41,30 @@ class Minitouch(object):
 
         self.max_x = 32767
         self.max_y = 32767
+        self.max_contacts = 2
 
         self.client = None
+        self.metrics = {
+            'server_starts': 0,
+            'connects': 0,
+            'reconnects': 0,
+            'connect_latency': None,
+            'sends': 0,
+            'send_time': 0.0,
+        }
 
     def install_server(self):
-        abi = self.adb.shell_command('getprop ro.product.cpu.abi')[0]
-        sdk_version = int(self.adb.shell_command('getprop ro.build.version.sdk')[0])
+        abi = self.adb.getprop('ro.product.cpu.abi')
+        sdk_version = int(self.adb.getprop('ro.build.version.sdk'))
 
         minitouch_bin = 'minitouch' if sdk_version >= 16 else 'minitouch-nopie'
 
         minitouch_bin_path = Path.joinpath(MINITOUCH_PATH, abi, minitouch_bin)
-        self.adb.push_local_file(str(minitouch_bin_path), '{}/minitouch'.format(self.dir))
-        self.adb.shell_command('chmod 755 {}/minitouch'.format(self.dir))
+        self.artifacts.push([(minitouch_bin_path, '{}/minitouch'.format(self.dir))], mode=755)
 
     def uninstall_server(self):
         self.adb.shell_command('rm -rf {}/minitouch*'.format(self.dir))
+        self.artifacts.invalidate()
 
     def start_server(self):
         def before_start(server_process):
@@ -54,20 +75,11 @@ class Minitouch(object):
             pass
 
         def start(adb):
-            @retry(exceptions=MinitouchException, tries=3)
-            def get_local_port(adb):
-                candidate_port = random.randint(30000, 32000)
-                _, outputs = adb.run_cmd(['forward', '--list'])
-
-                for output in outputs:
-                    if 'tcp:{}'.format(candidate_port) in output:
-                        raise MinitouchException('candidate port() is not available.'.format(candidate_port))
-
-                return candidate_port
-
-            self.local_port = get_local_port(adb)
-            self.device_port = 'minitouch_{}'.format(self.local_port)
-            adb.forward_socket('tcp:{}'.format(self.local_port), 'localabstract:{}'.format(self.device_port))
+            # the forward is kept for the life of the Minitouch, a restarted server listens on the same socket
+            if self.local_port is None:
+                self.local_port, self.device_port = get_port_allocator().allocate(adb, 'minitouch')
+            else:
+                adb.forward_socket('tcp:{}'.format(self.local_port), 'localabstract:{}'.format(self.device_port))
 
             process = adb.shell_command_ext('{}/minitouch -n {} 2>&1'.format(self.dir, self.device_port))
             stream_reader = NonBlockingStreamReader(process.stdout)
@@ -79,16 +91,18 @@ class Minitouch(object):
 
                 line = line.decode('utf-8')
 
-                m = re.match("Type \w touch device .+ \((\d+)x(\d+) with \d+ contacts\) detected on .+ \(.+\)", line)
+                m = re.match("Type \w touch device .+ \((\d+)x(\d+) with (\d+) contacts\) detected on .+ \(.+\)", line)
                 if m is not None:
                     self.max_x = int(m.group(1))
                     self.max_y = int(m.group(2))
+                    self.max_contacts = int(m.group(3))
                     break
 
             if process.poll() is not None:
                 raise RuntimeError('minitouch server quit immediately')
 
             self.server_process = process
+            self.metrics['server_starts'] += 1
             return process
 
         before_start(self.server_process)
@@ -96,41 +110,143 @@ class Minitouch(object):
         after_start()
 
     def kill_server(self):
-        pass
+        if self.server_process is not None:
+            self.server_process.kill()
+            self.server_process = None
+        reset_method_ready(self, 'install_and_set_up')
 
     def start_client(self):
+        start = time.time()
         self.client = SimpleClient(host='localhost', port=self.local_port)
         self.client.connect()
 
         def test_connection(client):
+            '''
+            Read the banner: `v <version>`, `^ <max-contacts> <max-x> <max-y> <max-pressure>`, `$ <pid>`
+            '''
             data = ''
-            while True:
-                try:
-                    data += client.receive(4096)
-
-                    if data.count('\n') >= 3:
-                        break
-                except socket.timeout:
-                    break
+            client.socket.settimeout(5.0)
+            try:
+                while data.count('\n') < 3:
+                    received = client.receive(4096)
+                    if not received:
+                        raise MinitouchException('minitouch closed the connection')
+                    data += received
+            except socket.timeout:
+                pass
+            finally:
+                client.socket.settimeout(None)
+
+            m = re.search(r'^\^ (\d+) (\d+) (\d+)', data, re.M)
+            if m is not None:
+                self.max_contacts, self.max_x, self.max_y = int(m.group(1)), int(m.group(2)), int(m.group(3))
 
         test_connection(self.client)
+        self.metrics['connects'] += 1
+        self.metrics['connect_latency'] = time.time() - start
 
     def kill_client(self):
-        self.client.close()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
     def install_and_set_up(self):
+        self.kill_client()
         self.install_server()
         self.start_server()
         self.start_client()
 
+    def get_transform(self):
+        """
+        Return the TouchTransform of the current rotation, None if the display info is unknown
+        """
+        if self.get_display_info is None:
+            return None
+        display_info = self.get_display_info()
+        return get_touch_transform(display_info['width'], display_info['height'], display_info.get('rotation', 0),
+                                   self.max_x, self.max_y)
+
+    def is_healthy(self):
+        """
+        Probe the connection without sending anything: the server process runs and the socket is not closed
+        (minitouch sends nothing after its banner, a readable socket has been closed)
+        """
+        if self.client is None or self.server_process is None or self.server_process.poll() is not None:
+            return False
+        try:
+            readable, _, _ = select.select([self.client.socket], [], [], 0)
+            return not readable or self.client.socket.recv(1, socket.MSG_PEEK) != b''
+        except (socket.error, ValueError):
+            return False
+
+    def reconnect(self):
+        """
+        Connect again, restarting the server first if it died
+        """
+        self.kill_client()
+        if self.server_process is None or self.server_process.poll() is not None:
+            self.start_server()
+        self.start_client()
+        self.metrics['reconnects'] += 1
+
+    def get_metrics(self):
+        """
+        Returns:
+            dict of connection counters and latencies (seconds)
+
+        """
+        metrics = dict(self.metrics)
+        metrics['send_latency'] = metrics['send_time'] / metrics['sends'] if metrics['sends'] else None
+        return metrics
+
+    def _send(self, cmd):
+        for attempt in range(2):
+            try:
+                if self.client is None or settings.MINITOUCH_HEALTH_CHECK and not self.is_healthy():
+                    LOGGER.warning('minitouch connection is broken, reconnecting')
+                    self.reconnect()
+
+                start = time.time()
+                self.client.send(cmd)
+                self.metrics['sends'] += 1
+                self.metrics['send_time'] += time.time() - start
+                return
+            except (socket.error, RuntimeError, MinitouchException) as e:
+                if attempt:
+                    # the server or the forward is gone, it will be set up again on the next call
+                    reset_method_ready(self, 'install_and_set_up')
+                    raise
+                LOGGER.warning('minitouch send failed ({}), reconnecting'.format(e))
+                self.kill_client()
+
     def __convert_xy(self, xy):
         x, y = xy
 
         return tuple(x, y)
 
-    # tap or long tap depends on interval
+    @settle
     @on_method_ready('install_and_set_up')
     @logwrap(LOGGER)
+    def perform(self, gesture, wait=True):
+        """
+        Send the whole gesture in a single write, minitouch plays its `w` pauses itself
+
+        Args:
+            gesture: Gesture
+            wait: True to return once the device has played the gesture
+
+        Raises:
+            MinitouchException: if the gesture uses more contacts than the device supports
+
+        """
+        if gesture.contacts and max(gesture.contacts) >= self.max_contacts:
+            raise MinitouchException('the gesture uses contacts {}, the device supports {} contacts'.format(
+                sorted(gesture.contacts), self.max_contacts))
+        self._send(gesture.to_bytes(self.get_transform()))
+        if wait and gesture.duration:
+            time.sleep(gesture.duration / 1000.0)
+
+    # tap or long tap depends on interval
     def touch(self, xy, interval=0.01):
         '''
         https://github.com/openstf/minitouch
@@ -146,12 +262,8 @@ class Minitouch(object):
 
         x, y = xy
 
-        self.client.send("d 0 {:.0f} {:.0f} 50\nc\n".format(x, y))
-        time.sleep(interval)
-        self.client.send("u 0\nc\n")
+        self.perform(Gesture().tap(x, y, duration=interval * 1000))
 
-    @on_method_ready('install_and_set_up')
-    @logwrap(LOGGER)
     def touch_two_point(self, pos1, pos2, interval=0.01):
         '''
         https://github.com/openstf/minitouch
@@ -170,52 +282,76 @@ class Minitouch(object):
         x1, y1 = pos1
         x2, y2 = pos2
 
-        self.client.send("d 0 {:.0f} {:.0f} 50\nd 1 {:.0f} {:.0f} 50\nc\n".format(x1, y1, x2, y2))
-        time.sleep(interval)
-        self.client.send("u 0\nu 1\nc\n")
+        self.perform(Gesture().down(0, x1, y1).down(1, x2, y2).commit().wait(interval * 1000).up(0).up(1).commit())
 
-    @on_method_ready('install_and_set_up')
-    @logwrap(LOGGER)
-    def swipe(self, from_xy, to_xy, interval=0.1, steps=5):
+    def swipe(self, from_xy, to_xy, duration=0.3, steps=None, rate=None, easing=None):
         '''
         https://github.com/openstf/minitouch
         
-        Swipe from (0, 0) to (100, 0) using a single contact. You'll need to wait between commits in your own code to slow it down.
+        Swipe from (0, 0) to (100, 0) using a single contact, the positions are eased over the duration and the
+        pauses between commits are `w` commands.
 
         d 0 0 0 50
         c
-        m 0 20 0 50
-        c
-        m 0 40 0 50
-        c
-        m 0 60 0 50
-        c
-        m 0 80 0 50
+        w 10
+        m 0 1 0 50
         c
+        w 10
+        ...
         m 0 100 0 50
         c
         u 0
         c
-        
+
+        Args:
+            duration: seconds from the first to the last position
+            steps: number of moves, default is `duration` * `rate`
+            rate: moves per second, default is settings.SWIPE_RATE
+            easing: name in gesture.EASINGS, default is settings.SWIPE_EASING
+
         '''
-        from_x, from_y = from_xy
-        to_x, to_y = to_xy
-
-        self.client.send("d 0 {:.0f} {:.0f} 50\nc\n".format(from_x, from_y))
-        time.sleep(interval)
-
-        for i in range(1, steps):
-            self.client.send("m 0 {:.0f} {:.0f} 50\nc\n".format(
-                from_x + (to_x - from_x) * i / steps,
-                from_y + (to_y - from_y) * i / steps,
-            ))
-            time.sleep(interval)
-        for i in range(steps):
-            self.client.send("m 0 {:.0f} {:.0f} 500\nc\n".format(to_x, to_y))
-            time.sleep(interval)
-        self.client.send("u 0\nc\n")
+        self.perform(Gesture().swipe(from_xy, to_xy, duration * 1000, rate or settings.SWIPE_RATE,
+                                     easing or settings.SWIPE_EASING, steps))
 
-    @on_method_ready('install_and_set_up')
-    @logwrap(LOGGER)
-    def pinch(self, *args, **kwargs):
-        raise MinitouchException()
\ No newline at end of file
+    def drag(self, from_xy, to_xy, duration=0.5, press=0.5, hold=0.1, steps=None, rate=None, easing=None):
+        '''
+        Press on `from_xy`, move to `to_xy` and stay there before lifting, so it drags and does not fling
+
+        Args:
+            duration: seconds from the first to the last position
+            press: seconds to stay down on `from_xy` before moving (long press to pick the item)
+            hold: seconds to stay down on `to_xy` before lifting
+            easing: name in gesture.EASINGS, default is settings.DRAG_EASING
+
+        '''
+        self.perform(Gesture().swipe(from_xy, to_xy, duration * 1000, rate or settings.SWIPE_RATE,
+                                     easing or settings.DRAG_EASING, steps, press=press * 1000, hold=hold * 1000))
+
+    def pinch(self, center, from_radius, to_radius, fingers=2, angle=0, duration=0.3, steps=None, rate=None,
+              easing=None):
+        '''
+        Pinch with `fingers` contacts evenly spread around `center` moving in lockstep from `from_radius` to
+        `to_radius`: zoom in when the radius grows, zoom out when it shrinks
+
+        Args:
+            angle: degrees of the first finger, 0 is on the right of the center
+            duration: seconds from the first to the last position
+
+        '''
+        self.perform(Gesture().pinch(center, from_radius, to_radius, fingers, angle, duration * 1000,
+                                     rate or settings.SWIPE_RATE, easing or settings.DRAG_EASING, steps))
+
+    def rotate(self, center, radius, degrees, fingers=2, angle=0, duration=0.3, steps=None, rate=None,
+               easing=None):
+        '''
+        Turn `fingers` contacts evenly spread on a circle around `center` by `degrees`, clockwise on the screen
+        '''
+        self.perform(Gesture().rotate(center, radius, degrees, fingers, angle, duration * 1000,
+                                      rate or settings.SWIPE_RATE, easing or settings.DRAG_EASING, steps))
+
+    def multi_swipe(self, from_xys, to_xys, duration=0.3, steps=None, rate=None, easing=None):
+        '''
+        Swipe with one finger per (from, to) pair, e.g. a three-finger swipe
+        '''
+        self.perform(Gesture().multi_swipe(from_xys, to_xys, duration * 1000, rate or settings.SWIPE_RATE,
+                                           easing or settings.SWIPE_EASING, steps))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import functools
+
+import numpy as np
+
+
+class TouchTransform(object):
+    """
+    Map screen positions (pixels of the screenshot, which is upright in the current rotation) to the touch
+    device: rotate them back to the natural orientation of the display, then scale them to the touch range
+    (0..max_x, 0..max_y) reported by minitouch.
+
+    Both steps are a single 2x3 affine matrix, applied to all the positions of a gesture at once.
+    """
+
+    def __init__(self, width, height, rotation, max_x, max_y):
+        """
+        Args:
+            width, height: display size in its natural orientation, as given by `minicap -i`
+            rotation: display rotation in degrees, 0, 90, 180 or 270
+            max_x, max_y: touch range of the touch device
+
+        """
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+        self.max_x = max_x
+        self.max_y = max_y
+
+        w, h = float(width), float(height)
+        # screen position -> natural orientation position, per quarter turn
+        rotate = {
+            0: [[1, 0, 0], [0, 1, 0]],
+            1: [[0, -1, w], [1, 0, 0]],
+            2: [[-1, 0, w], [0, -1, h]],
+            3: [[0, 1, 0], [-1, 0, h]],
+        }[int(rotation) // 90 % 4]
+        scale = np.diag([max_x / w, max_y / h])
+        self.matrix = scale.dot(np.array(rotate, dtype=np.float64))
+
+    def __call__(self, points):
+        """
+        Args:
+            points: (N, 2) array of screen positions
+
+        Returns:
+            (N, 2) array of touch device positions, clipped to the touch range
+
+        """
+        points = np.asarray(points, dtype=np.float64)
+        touch_points = points.dot(self.matrix[:, :2].T) + self.matrix[:, 2]
+        return np.clip(touch_points, 0, [self.max_x, self.max_y])
+
+    def point(self, xy):
+        return tuple(self([xy])[0])
+
+    def __repr__(self):
+        return 'TouchTransform({}x{} rotation {} -> {}x{})'.format(
+            self.width, self.height, self.rotation, self.max_x, self.max_y)
+
+
+@functools.lru_cache(maxsize=64)
+def get_touch_transform(width, height, rotation, max_x, max_y):
+    """
+    The transform is computed once per display, rotation and touch range
+    """
+    return TouchTransform(width, height, rotation, max_x, max_y)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+import re
+import threading
+import time
+
+from logger import get_logger
+from minitest.core import settings
+
+LOGGER = get_logger(__name__)
+
+ROTATION_PATTERN = re.compile(r'rotation:(\S*)')
+
+
+class RotationWatcher(object):
+    """
+    Keep the display orientation (0-3, quarter turns) current from one long-lived shell.
+
+    The device polls `dumpsys input` (SurfaceOrientation) and only prints a line when the orientation changes,
+    so nothing is sent while the device stays still and reading the orientation costs no adb call. Listeners
+    are called from the watcher thread on every change.
+
+    `orientation` is None whenever the watcher is not running. Some releases have no SurfaceOrientation in
+    `dumpsys input`, the watcher is then marked as not `supported` and the orientation has to be read with
+    `minicap -i`. A watcher which has stopped by itself is only started again after a delay
+    (settings.ROTATION_WATCH_RESTART_DELAY), growing while it keeps stopping.
+    """
+
+    SCRIPT = ('last=-1; while true; do '
+              'r=$(dumpsys input | grep -m 1 SurfaceOrientation); r=${{r##*: }}; '
+              'if [ "$r" != "$last" ]; then echo "rotation:$r"; last=$r; fi; '
+              'sleep {}; done')
+
+    def __init__(self, adb, interval=None):
+        self.adb = adb
+        self.interval = settings.ROTATION_WATCH_INTERVAL if interval is None else interval
+
+        self.orientation = None
+        self.supported = True
+        self.listeners = []
+        self.process = None
+        self._thread = None
+        self._started_at = 0
+        self._next_start = 0
+        self._restart_delay = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+
+    def add_listener(self, listener):
+        """
+        Call `listener(orientation)` on every orientation change
+        """
+        self.listeners.append(listener)
+
+    def start(self):
+        """
+        Returns:
+            True if the watcher has been started, False if it runs already, is not supported or has to wait
+            before restarting
+
+        """
+        with self._lock:
+            if self.is_alive() or not self.supported or time.time() < self._next_start:
+                return False
+            self._started_at = time.time()
+            self.process = self.adb.shell_command_ext(self.SCRIPT.format(self._device_interval()))
+            if self.process is None:
+                LOGGER.warning('rotation watcher can not be started: {}'.format(self.adb.get_error()))
+                self._back_off()
+                return False
+            self._thread = threading.Thread(target=self._run, args=(self.process,), name='rotation-watcher')
+            self._thread.daemon = True
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            if self.process is not None:
+                self.process.kill()
+                self.process = None
+            self.orientation = None
+            self._next_start = 0
+            self._restart_delay = 0
+
+    def _device_interval(self):
+        # toolbox `sleep` (before toybox, Android 6) only takes whole seconds, `sleep 0.5` would not pause at all
+        sdk_version = self.adb.getprop('ro.build.version.sdk')
+        if sdk_version and int(sdk_version) < 23:
+            return max(1, int(math.ceil(self.interval)))
+        return self.interval
+
+    def _back_off(self):
+        first, maximum = settings.ROTATION_WATCH_RESTART_DELAY
+        # a watcher which ran longer than the maximum delay starts over with the first delay
+        if time.time() - self._started_at > maximum:
+            self._restart_delay = 0
+        self._restart_delay = min(maximum, self._restart_delay * 2 or first)
+        self._next_start = time.time() + self._restart_delay
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def wait_for_orientation(self, timeout=None):
+        """
+        Wait until the first orientation has been read, or the watcher has stopped
+
+        Returns:
+            the orientation, None if it is not known yet
+
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.orientation is not None or self.process is None, timeout=timeout)
+            return self.orientation
+
+    def _run(self, process):
+        for line in iter(process.stdout.readline, b''):
+            m = ROTATION_PATTERN.search(line.decode('utf-8', 'ignore'))
+            if m is None:
+                continue
+            if self.process is not process:
+                break
+
+            if m.group(1) not in ('0', '1', '2', '3'):
+                LOGGER.warning('can not read the orientation from `dumpsys input`: {!r}, rotation watcher '
+                               'disabled'.format(m.group(1)))
+                self.supported = False
+                process.kill()
+                break
+
+            orientation = int(m.group(1))
+            LOGGER.info('display orientation: {} -> {}'.format(self.orientation, orientation))
+            with self._changed:
+                self.orientation = orientation
+                self._changed.notify_all()
+            for listener in list(self.listeners):
+                try:
+                    listener(orientation)
+                except Exception as e:
+                    LOGGER.error('rotation listener failed: {}'.format(e))
+
+        with self._lock:
+            if self.process is process:
+                self._back_off()
+                if self.supported:
+                    LOGGER.warning('rotation watcher stopped, restart in {}s'.format(self._restart_delay))
+                self.process = None
+                with self._changed:
+                    self.orientation = None
+                    self._changed.notify_all()
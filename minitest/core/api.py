@@ -4,9 +4,12 @@
 # @Author: hlliu
 
 from logger import get_logger
+from minitest.core import settings
 from minitest.core.android.android import Android
-from minitest.core.cv import loop_find, Template
+from minitest.core.android.device_pool import DevicePool
+from minitest.core.cv import loop_find, loop_find_any, preload_templates, wait_screen_change, Template
 from minitest.core.helper import G
+from minitest.core.settings import FIND_TIMEOUT
 
 LOGGER = get_logger(__name__)
 
@@ -14,9 +17,41 @@ LOGGER = get_logger(__name__)
 def auto_setup():
     G.DEVICE = Android()
 
+    if settings.PRELOAD_TEMPLATES:
+        LOGGER.info('{} templates preloaded'.format(preload_templates()))
 
-def touch(s_img):
-    pos = loop_find(Template(s_img))
+
+def auto_setup_pool(serials=None, max_workers=None):
+    """
+    Set up several devices (all connected ones by default) in parallel
+
+    Returns:
+        DevicePool, run a script on every device with `run_on_devices` or `DevicePool.run`
+
+    """
+    pool = DevicePool(serials, max_workers=max_workers)
+    pool.connect()
+
+    if settings.PRELOAD_TEMPLATES:
+        LOGGER.info('{} templates preloaded'.format(preload_templates()))
+
+    return pool
+
+
+def run_on_devices(pool, func, *args, **kwargs):
+    """
+    Run `func(*args, **kwargs)` concurrently on every device of the pool, in `func` the api functions of this
+    module act on the device of the current thread
+
+    Returns:
+        dict of serial and the function result, or the exception it raised
+
+    """
+    return pool.run(func, *args, **kwargs)
+
+
+def touch(s_img, region=None):
+    pos = loop_find(Template(s_img, region=region))
 
     # 点击 目标图片匹配到的区域的中间点 (使用minitouch)
     G.DEVICE.minitouch.touch(pos)
@@ -24,7 +59,7 @@ def touch(s_img):
 
 def assert_exit(s_img):
     try:
-        pos = loop_find(s_img)
+        pos = loop_find(Template(s_img))
     except Exception as e:
         LOGGER.info(e)
         return False
@@ -32,12 +67,44 @@ def assert_exit(s_img):
     return True
 
 
+def wait_any(s_imgs):
+    """
+    Wait until any of the pictures is in the screen, all of them are matched in the same screenshot
+
+    Returns:
+        dict of the found pictures and their positions
+
+    """
+    templates = {Template(s_img): s_img for s_img in s_imgs}
+    hits = loop_find_any(templates)
+
+    return {templates[t]: pos for t, pos in hits.items()}
+
+
+def assert_exit_any(s_imgs):
+    try:
+        hits = wait_any(s_imgs)
+    except Exception as e:
+        LOGGER.info(e)
+        return {}
+
+    return hits
+
+
+def wait_change(time_out=FIND_TIMEOUT):
+    return wait_screen_change(time_out)
+
+
 def text(str):
     G.DEVICE.ime.text(str)
 
 
-def swipe(from_xy, to_xy):
-    G.DEVICE.swipe(from_xy, to_xy)
+def swipe(from_xy, to_xy, duration=0.5):
+    G.DEVICE.swipe(from_xy, to_xy, duration=duration)
+
+
+def drag(from_xy, to_xy, duration=0.5):
+    G.DEVICE.drag(from_xy, to_xy, duration=duration)
 
 
 def install(filepath):
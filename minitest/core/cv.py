@@ -2,37 +2,144 @@
 # -*- coding: utf-8 -*-
 # @Date  : 2018/12/20 15:15
 # @Author: hlliu
+import functools
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 
 from config import IMAGE_ROOT
+from logger import get_logger
+from minitest.core import settings
 from minitest.core.cv2.img_utils import ImgUtils
 from minitest.core.error import TargetNotFoundError
 from minitest.core.helper import G
 from minitest.core.settings import FIND_TIMEOUT, LOG_DIR
+from minitest.core.utils.screen_writer import write_screen
+
+LOGGER = get_logger(__name__)
 
 
 def loop_find(t, time_out=FIND_TIMEOUT, interval=0.5):
     if not isinstance(t, Template):
         raise TypeError('t is not the Template type')
 
+    return loop_find_any([t], time_out=time_out, interval=interval)[t]
+
+
+def loop_find_any(templates, time_out=FIND_TIMEOUT, interval=0.5):
+    """
+    Wait until at least one of the templates is in the screen, every poll takes a single screenshot
+
+    Returns:
+        dict of the found templates and their positions
+
+    """
+    templates = list(templates)
+    if not all(isinstance(t, Template) for t in templates):
+        raise TypeError('t is not the Template type')
+
     start_time = time.time()
+    last_screen, last_signature = None, None
     while True:
         # 截图，rgb图像
         screen = G.DEVICE.snapshot()
-        # 创建一个原始图像的灰度版
-        screen_gray = cv2.cvtColor(ImgUtils.str2img(screen), cv2.COLOR_BGR2GRAY)
-        pos = t.match_in(screen_gray)
-        if pos:
-            log_screen(screen)
-            return pos
+        # the same frame as the previous one: nothing new to search
+        changed = screen != last_screen
+        last_screen = screen
+        if changed:
+            # compared with the last frame the templates have been searched in, not the previous one, so a slow
+            # change (fade in, slide) is noticed once it adds up
+            signature = frame_signature(ImgUtils.str2gray(screen, reduce=8))
+            changed = last_signature is None or frame_changed(last_signature, signature)
+            if changed:
+                last_signature = signature
+
+        if changed:
+            # 创建一个原始图像的灰度版
+            screen_gray = ImgUtils.str2gray(screen)
+            hits = {t: pos for t, pos in match_all(templates, screen_gray).items() if pos}
+            if hits:
+                log_screen(screen)
+                return hits
         if time.time() - start_time > time_out:
             log_screen(screen)
-            raise TargetNotFoundError('Picture {} not found in screen'.format(t))
+            raise TargetNotFoundError('Picture {} not found in screen'.format(', '.join(map(str, templates))))
         else:
-            time.sleep(interval)
+            # returns as soon as a new frame is available when the device can tell
+            G.DEVICE.wait_for_frame(interval)
+
+
+def frame_signature(screen_gray):
+    """
+    Return a small thumbnail of the screen, every pixel being the mean of a block of the screen. A screen
+    decoded at a reduced size is enough.
+    """
+    size = settings.FRAME_SIGNATURE_SIZE
+    return cv2.resize(screen_gray, (size, size), interpolation=cv2.INTER_AREA)
+
+
+def frame_changed(signature1, signature2):
+    return cv2.absdiff(signature1, signature2).max() > settings.FRAME_CHANGE_THRESHOLD
+
+
+def wait_screen_change(time_out=FIND_TIMEOUT, interval=0.5):
+    """
+    Wait until the screen differs from the current one
+
+    Returns:
+        True if the screen has changed, False if the timeout expired
+
+    """
+    start_time = time.time()
+    screen = G.DEVICE.snapshot()
+    signature = frame_signature(ImgUtils.str2gray(screen, reduce=8))
+    while time.time() - start_time < time_out:
+        G.DEVICE.wait_for_frame(min(interval, max(0, time_out - (time.time() - start_time))))
+        new_screen = G.DEVICE.snapshot()
+        if new_screen == screen:
+            continue
+        new_signature = frame_signature(ImgUtils.str2gray(new_screen, reduce=8))
+        if frame_changed(signature, new_signature):
+            return True
+    return False
+
+
+_MATCH_POOL = None
+_MATCH_POOL_LOCK = threading.Lock()
+
+
+def _match_pool():
+    global _MATCH_POOL
+    with _MATCH_POOL_LOCK:
+        if _MATCH_POOL is None:
+            _MATCH_POOL = ThreadPoolExecutor(max_workers=settings.MATCH_THREADS, thread_name_prefix='match')
+        return _MATCH_POOL
+
+
+def match_all(templates, screen_gray, parallel=True):
+    """
+    Match several templates in one gray screen, the downscaled screens are shared by all templates
+
+    Args:
+        templates: list of Template
+        screen_gray: gray screen
+        parallel: match in a thread pool, OpenCV releases the GIL while matching
+
+    Returns:
+        dict of every template and its position, None if not found
+
+    """
+    levels = {}
+    # read in the calling thread, the pool threads do not see the device bound by bind_device
+    device_key = _device_key()
+    if not parallel or len(templates) < 2 or settings.MATCH_THREADS < 2:
+        return {t: t.match_in(screen_gray, levels, device_key) for t in templates}
+
+    futures = [(t, _match_pool().submit(t.match_in, screen_gray, levels, device_key)) for t in templates]
+    return {t: future.result() for t, future in futures}
 
 
 def log_screen(screen=None):
@@ -41,32 +148,267 @@ def log_screen(screen=None):
 
     file_name = str(time.time() * 1000) + '.jpg'
     file_path = os.path.join(LOG_DIR, file_name)
-    ImgUtils.imwrite(file_path, screen)
+    write_screen(file_path, screen)
 
 
 class Template(object):
-    def __init__(self, img_name):
+    def __init__(self, img_name, threshold=0.8, resolution=None, scales=None, region=None):
+        """
+        Args:
+            img_name: image file name under IMAGE_ROOT
+            threshold: minimum matching confidence
+            resolution: (width, height) of the screen the template was captured on, the template is scaled to
+                the resolution of the screen it is matched in
+            scales: extra scale factors tried on top of it (e.g. (0.9, 1.0, 1.1)) when the capture
+                resolution is not exactly known
+            region: (x1, y1, x2, y2) part of the screen to search, in pixels or, when every value is between 0
+                and 1 and one of them at least is a float, relative to the display size
+
+        """
         self.img_path = os.path.join(IMAGE_ROOT, img_name)
-        self.img_cv2 = cv2.imread(self.img_path)
+        self.image = load_template(self.img_path)
         # 灰度图像
-        self.img_cv2_gray = cv2.cvtColor(self.img_cv2, cv2.COLOR_BGR2GRAY)
+        self.img_cv2_gray = self.image.gray
+
+        self.threshold = threshold
+        self.resolution = resolution
+        self.scales = scales or (1.0,)
+        self.region = region
+
+    @property
+    def img_cv2(self):
+        return cv2.imread(self.img_path)
+
+    def __str__(self):
+        return self.img_path
+
+    def match_in(self, target_gray, levels=None, device_key=None):
+        pos, _ = self.match_with_confidence(target_gray, levels, device_key)
+        return pos
+
+    def match_with_confidence(self, target_gray, levels=None, device_key=None):
+        """
+        Find the template in the gray screen: around where it was last seen first, then in its region (the
+        whole screen by default) trying every scale coarse-to-fine
+
+        Args:
+            target_gray: gray screen
+            levels: optional dict caching the downscaled screens, to share them between templates
+            device_key: device the screen comes from, the current device (G.DEVICE) by default
 
-    def match_in(self, target_gray):
-        # 图片匹配 (使用cv2的图像匹配)
+        Returns:
+            (center position, confidence) of the best match, position is None if under the threshold
+
+        """
+        box = self._region_box(target_gray)
+
+        device_key = _device_key() if device_key is None else device_key
+        last_seen_key = (device_key, self.img_path, target_gray.shape[:2])
+        last_seen = _LAST_SEEN.get(last_seen_key)
+        if last_seen is not None:
+            pos, val = self._match_last_seen(target_gray, box, *last_seen)
+            if val >= self.threshold:
+                return pos, val
+
+        best_pos, best_val, best_scale = None, -1, None
+        for scale in self._match_scales(target_gray):
+            pos, val = self._match_pyramid(target_gray, box, scale, levels if levels is not None else {})
+            if val > best_val:
+                best_pos, best_val, best_scale = pos, val, scale
+
+        # 设置阈值，如果匹配的最大值大于0.8，则表明匹配到了
+        if best_val < self.threshold:
+            return None, best_val
+
+        _LAST_SEEN[last_seen_key] = (best_pos, best_scale)
+        return best_pos, best_val
+
+    def _region_box(self, target_gray):
+        sh, sw = target_gray.shape[:2]
+        if not self.region:
+            return 0, 0, sw, sh
+
+        x1, y1, x2, y2 = self.region
+        # relative when every value is in [0, 1] and one of them at least is a float, e.g. (0, 0, 0.5, 1)
+        if all(0 <= v <= 1 for v in self.region) and any(isinstance(v, float) for v in self.region):
+            x1, y1, x2, y2 = x1 * sw, y1 * sh, x2 * sw, y2 * sh
+        box = max(0, int(x1)), max(0, int(y1)), min(sw, int(round(x2))), min(sh, int(round(y2)))
+        if box[2] <= box[0] or box[3] <= box[1]:
+            raise ValueError('region {} is empty in a {}x{} screen'.format(self.region, sw, sh))
+        return box
+
+    def _match_last_seen(self, target_gray, box, pos, scale):
+        tpl = self._template(scale)
+        th, tw = tpl.shape[:2]
+        rx0, ry0, rx1, ry1 = box
+        margin_x = int(tw * settings.MATCH_LAST_SEEN_MARGIN)
+        margin_y = int(th * settings.MATCH_LAST_SEEN_MARGIN)
+
+        # the neighborhood of the last position, kept inside the region
+        x0 = max(rx0, int(pos[0] - tw / 2) - margin_x)
+        y0 = max(ry0, int(pos[1] - th / 2) - margin_y)
+        x1 = min(rx1, int(pos[0] + tw / 2) + margin_x)
+        y1 = min(ry1, int(pos[1] + th / 2) + margin_y)
+        if x1 <= x0 or y1 <= y0:
+            return None, -1
+        return self._match_roi(target_gray[y0:y1, x0:x1], tpl, x0, y0)
+
+    def _match_scales(self, target_gray):
+        base = 1.0
+        if self.resolution:
+            # compare the short sides, so a landscape screen matches a portrait capture
+            base = float(min(target_gray.shape[:2])) / min(self.resolution)
+        return [base * scale for scale in self.scales]
+
+    def _template(self, scale, level=0):
+        return self.image.resized(scale, level)
+
+    def _pyramid_level(self, scale):
+        return self.image.pyramid_level(scale)
+
+    def _match_pyramid(self, target_gray, box, scale, levels):
+        rx0, ry0, rx1, ry1 = box
+        region_gray = target_gray[ry0:ry1, rx0:rx1]
+
+        tpl = self._template(scale)
+        th, tw = tpl.shape[:2]
+        sh, sw = region_gray.shape[:2]
+        if th > sh or tw > sw:
+            return None, -1
+
+        level = self._pyramid_level(scale)
+        factor = 2 ** level
+        # a region hardly larger than the template has few positions to try, while the downscaled template (sizes
+        # rounded) may not even fit in the downscaled region (sizes floored): match it at full resolution
+        if level == 0 or sw - tw < 4 * factor or sh - th < 4 * factor:
+            return self._match_roi(region_gray, tpl, rx0, ry0)
+
+        # match at the downscaled resolution first
+        small_screen = levels.get((factor, box))
+        if small_screen is None:
+            small_screen = levels[(factor, box)] = cv2.resize(region_gray, (sw // factor, sh // factor),
+                                                              interpolation=cv2.INTER_AREA)
+        _, coarse_val, coarse_loc = self._match_max(small_screen, self._template(scale, level))
+        if coarse_val < self.threshold - settings.MATCH_PYRAMID_COARSE_SLACK:
+            return None, coarse_val
+
+        # then refine around the candidate at full resolution
+        margin = 2 * factor
+        x0 = max(0, coarse_loc[0] * factor - margin)
+        y0 = max(0, coarse_loc[1] * factor - margin)
+        x1 = min(sw, coarse_loc[0] * factor + tw + margin)
+        y1 = min(sh, coarse_loc[1] * factor + th + margin)
+        return self._match_roi(region_gray[y0:y1, x0:x1], tpl, rx0 + x0, ry0 + y0)
+
+    @staticmethod
+    def _match_max(target_gray, tpl):
         # 使用matchTemplate对原始灰度图像和图像模板进行匹配
-        res = cv2.matchTemplate(target_gray, self.img_cv2_gray, cv2.TM_CCOEFF_NORMED)
+        res = cv2.matchTemplate(target_gray, tpl, cv2.TM_CCOEFF_NORMED)
         # res 矩阵中最小值，最大值，最小值坐标，最大值坐标
         min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        return res, max_val, max_loc
 
+    def _match_roi(self, roi_gray, tpl, offset_x, offset_y):
         # 模板图片的高和宽
-        h, w = self.img_cv2.shape[:2]
+        h, w = tpl.shape[:2]
+        if roi_gray.shape[0] < h or roi_gray.shape[1] < w:
+            return None, -1
 
-        focus_pos = None
-        # 设置阈值，如果匹配的最大值大于0.8，则表明匹配到了
-        if max_val > 0.8:
-            focus_pos = max_loc[0] + w / 2, max_loc[1] + h / 2
+        _, max_val, max_loc = self._match_max(roi_gray, tpl)
+        focus_pos = offset_x + max_loc[0] + w / 2, offset_y + max_loc[1] + h / 2
+        return focus_pos, max_val
+
+
+# where each template has last been found: (device, img path, screen shape) -> (center position, scale)
+_LAST_SEEN = {}
+
+
+def _device_key():
+    # devices of a DevicePool share the process, the last positions are kept per device
+    device = G.DEVICE
+    return getattr(getattr(device, 'adb', None), 'serial', None) or id(device)
+
+
+class TemplateImage(object):
+    """
+    Gray template loaded from disk, with what the matcher derives from it (scaled and downscaled versions,
+    pyramid level), shared by every Template of the same file through `load_template`.
+    """
+
+    def __init__(self, path):
+        img = cv2.imread(path)
+        if img is None:
+            raise IOError('can not read template {}'.format(path))
+        # converted like the screen is, so both are comparable
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        self.path = path
+        self.gray = img
+        self.shape = img.shape[:2]
+        # keyed by (scale, pyramid level)
+        self._resized = {(1.0, 0): img}
+        self._levels = {}
+        # warm the pyramid of the template at its own scale
+        for level in range(1, self.pyramid_level(1.0) + 1):
+            self.resized(1.0, level)
+
+    def resized(self, scale, level=0):
+        key = (round(scale, 4), level)
+        tpl = self._resized.get(key)
+        if tpl is None:
+            factor = scale / (2 ** level)
+            h, w = self.shape
+            size = (max(1, int(round(w * factor))), max(1, int(round(h * factor))))
+            tpl = cv2.resize(self.gray, size, interpolation=cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR)
+            self._resized[key] = tpl
+        return tpl
+
+    def pyramid_level(self, scale):
+        key = round(scale, 4)
+        level = self._levels.get(key)
+        if level is None:
+            h, w = self.resized(scale).shape[:2]
+            level = 0
+            while level < settings.MATCH_PYRAMID_MAX_LEVEL and \
+                    min(h, w) / 2 ** (level + 1) >= settings.MATCH_PYRAMID_MIN_SIZE:
+                level += 1
+            self._levels[key] = level
+        return level
+
+
+@functools.lru_cache(maxsize=settings.TEMPLATE_CACHE_SIZE)
+def _load_template(path, mtime):
+    return TemplateImage(path)
+
+
+def load_template(path):
+    """
+    Return the cached TemplateImage of the file, it is loaded again when the file is modified
+    """
+    return _load_template(path, os.path.getmtime(path))
 
-        return focus_pos
 
+def preload_templates(root=IMAGE_ROOT, extensions=('.png',)):
+    """
+    Load the templates under `root` into the template cache, until it is full (settings.TEMPLATE_CACHE_SIZE):
+    loading more would only evict the first ones. A file which can not be read is skipped.
 
+    Returns:
+        number of loaded templates
 
+    """
+    count = 0
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            if settings.TEMPLATE_CACHE_SIZE is not None and count >= settings.TEMPLATE_CACHE_SIZE:
+                return count
+            if os.path.splitext(file_name)[1].lower() not in extensions:
+                continue
+            path = os.path.join(dir_path, file_name)
+            try:
+                load_template(path)
+            except (IOError, cv2.error) as e:
+                LOGGER.warning('template {} not preloaded: {}'.format(path, e))
+                continue
+            count += 1
+    return count
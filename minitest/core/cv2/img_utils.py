@@ -4,18 +4,37 @@ import cv2
 import numpy as np
 
 
+# cv2.imdecode flags of gray images decoded at 1/n of their size
+REDUCED_GRAYSCALE = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
 class ImgUtils:
     @staticmethod
     def img2str(img):
         _, png = cv2.imencode('.png', img)
-        return png.tostring()
+        return png.tobytes()
 
     @staticmethod
     def str2img(pngstr):
-        np_arr = np.fromstring(pngstr, np.uint8)
+        # a view on the encoded bytes, not a copy
+        np_arr = np.frombuffer(pngstr, np.uint8)
         img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
         return img
 
+    @staticmethod
+    def str2gray(imgstr, reduce=1):
+        """
+        Decode straight to a gray image, jpg decoders then skip the color conversion (and, with `reduce`
+        of 2, 4 or 8, most of the decoding)
+        """
+        np_arr = np.frombuffer(imgstr, np.uint8)
+        return cv2.imdecode(np_arr, REDUCED_GRAYSCALE[reduce])
+
     @staticmethod
     def imwrite(filename, screen):
         with open(filename, 'wb+') as f:
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 # @Date  : 2018/12/12 17:05
 # @Author: hlliu
+import time
+
 from six import with_metaclass
 
 
@@ -50,6 +52,11 @@ class Device(with_metaclass(MetaDevice, object)):
     def snapshot(self, *args, **kwargs):
         self._raise_not_implemented_error()
 
+    def wait_for_frame(self, timeout):
+        # devices which can not tell when their screen changes just wait
+        time.sleep(timeout)
+        return False
+
     def swipe(self, t1, t2, **kwargs):
         self._raise_not_implemented_error()
 
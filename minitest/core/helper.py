@@ -2,12 +2,19 @@
 # -*- coding: utf-8 -*-
 # @Date  : 2018/12/11 14:10
 # @Author: hlliu
+import contextlib
+import contextvars
 import functools
 import inspect
+import logging
+import threading
+from collections import deque
 
 import time
 import traceback
 
+from minitest.core import settings
+
 
 # def logwrap(logger):
 #
@@ -39,37 +46,76 @@ import traceback
 
 
 def logwrap(logger):
+    """
+    Trace the decorated call: log its arguments and record a span (name, start, end, duration) in SPANS.
+
+    When INFO is disabled on `logger` and settings.TRACE_SPANS is off the call goes straight through. The
+    post-action delay is not part of tracing, see `settle`.
+    """
 
     def Logwrap(func):
+        name = '{}.{}'.format(func.__module__, func.__qualname__)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            logger.info('{}.{}() is starting'.format(func.__module__, func.__qualname__))
+            log = logger.isEnabledFor(logging.INFO)
+            trace = settings.TRACE_SPANS
+            if not log and not trace:
+                return func(*args, **kwargs)
 
             start = time.time()
-            m = inspect.getcallargs(func, *args, **kwargs)
-            fndata = {'name': func.__name__, 'call_args': m, 'start_time': start}
-            # LOGGER.running_stack.append(fndata)
-
-            logger.info(fndata)
+            fndata = {'name': name, 'start_time': start}
+            if log:
+                logger.info('%s() is starting, call args: %s', name, inspect.getcallargs(func, *args, **kwargs))
 
             try:
-                res = func(*args, **kwargs)
-                time.sleep(2)
-            except Exception as e:
-                data = {"traceback": traceback.format_exc(), "end_time": time.time()}
-                fndata.update(data)
+                return func(*args, **kwargs)
+            except Exception:
+                fndata['traceback'] = traceback.format_exc()
                 raise
             finally:
-                logger.info(fndata)
-
-            logger.info('{}.{}() is end'.format(func.__module__, func.__qualname__))
-            return res
+                end = time.time()
+                fndata.update({'end_time': end, 'duration': end - start})
+                if trace:
+                    SPANS.append(fndata)
+                if log:
+                    logger.info(fndata)
 
         return wrapper
 
     return Logwrap
 
 
+# spans recorded by logwrap, the oldest are dropped first
+SPANS = deque(maxlen=settings.TRACE_SPAN_BUFFER_SIZE)
+
+
+def get_spans(name=None):
+    """
+    Return the recorded spans, optionally only those whose name ends with `name`
+    """
+    return [span for span in list(SPANS) if name is None or span['name'].endswith(name)]
+
+
+def clear_spans():
+    SPANS.clear()
+
+
+def settle(func):
+    """
+    Sleep settings.ACTION_SETTLE_DELAY seconds after the decorated action to let the UI react to it
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        res = func(*args, **kwargs)
+        if settings.ACTION_SETTLE_DELAY:
+            time.sleep(settings.ACTION_SETTLE_DELAY)
+        return res
+
+    return wrapper
+
+
 # def ready_method(func):
 #     @functools.wraps(func)
 #     def ready(inst, *args, **kwargs):
@@ -82,16 +128,83 @@ def logwrap(logger):
 
 
 def on_method_ready(method):
+    """
+    Make sure `inst.<method>()` has been called once before the decorated method.
+
+    The readiness is latched per instance (thread-safe) after the first successful call, use
+    `reset_method_ready` when what it prepared is gone, e.g. the device rebooted or the server died.
+    """
+
     def method_ready(func):
         @functools.wraps(func)
         def ready(inst, *args, **kwargs):
-            m = getattr(inst, method)
-            m()
+            ensure_method_ready(inst, method)
             res = func(inst, *args, **kwargs)
             return res
         return ready
     return method_ready
 
 
-class G(object):
-    DEVICE = None
\ No newline at end of file
+def ensure_method_ready(inst, method):
+    """
+    Call `inst.<method>()` unless it has already been latched by `on_method_ready`, e.g. to prepare eagerly
+    """
+    key = "_%s_ready" % method
+    if not getattr(inst, key, False):
+        with _ready_lock(inst):
+            if not getattr(inst, key, False):
+                getattr(inst, method)()
+                setattr(inst, key, True)
+
+
+def reset_method_ready(inst, *methods):
+    """
+    Forget the readiness latched by `on_method_ready`, the methods run again on the next call
+    """
+    with _ready_lock(inst):
+        for method in methods:
+            setattr(inst, "_%s_ready" % method, False)
+
+
+_READY_LOCKS_LOCK = threading.Lock()
+
+
+def _ready_lock(inst):
+    # reentrant: a ready method may call other methods decorated with on_method_ready
+    lock = inst.__dict__.get('_ready_lock')
+    if lock is None:
+        with _READY_LOCKS_LOCK:
+            lock = inst.__dict__.setdefault('_ready_lock', threading.RLock())
+    return lock
+
+
+# device bound to the current thread/context by bind_device, see G.DEVICE
+_BOUND_DEVICE = contextvars.ContextVar('minitest_device', default=None)
+
+
+@contextlib.contextmanager
+def bind_device(device):
+    """
+    Make `G.DEVICE` the given device in the current thread (context) only, e.g. in DevicePool workers
+    """
+    token = _BOUND_DEVICE.set(device)
+    try:
+        yield device
+    finally:
+        _BOUND_DEVICE.reset(token)
+
+
+class _GMeta(type):
+    @property
+    def DEVICE(cls):
+        device = _BOUND_DEVICE.get()
+        return cls._device if device is None else device
+
+    @DEVICE.setter
+    def DEVICE(cls, device):
+        cls._device = device
+
+
+class G(object, metaclass=_GMeta):
+    # G.DEVICE is the device bound with bind_device, or the process-wide one set by api.auto_setup
+    _device = None
\ No newline at end of file
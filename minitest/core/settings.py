@@ -5,4 +5,74 @@
 from config import IMAGE_ROOT
 
 FIND_TIMEOUT = 20
-LOG_DIR = IMAGE_ROOT
\ No newline at end of file
+LOG_DIR = IMAGE_ROOT
+
+# keep a long-lived minicap server and read frames from its socket instead of spawning `minicap -s` per screenshot
+MINICAP_STREAM = True
+# how many of the latest frames are kept in the minicap ring buffer
+MINICAP_STREAM_BUFFER_SIZE = 3
+
+# talk to the adb server over its socket protocol instead of spawning the adb binary for every command
+ADB_NATIVE_CLIENT = True
+
+# record a timing span for every call wrapped by helper.logwrap
+TRACE_SPANS = True
+TRACE_SPAN_BUFFER_SIZE = 1000
+# seconds to wait after a touch/swipe so the UI can react, 0 to rely on loop_find polling only
+ACTION_SETTLE_DELAY = 0
+
+# coarse-to-fine matching: the screen and template are downscaled by 2 ** level (at most MATCH_PYRAMID_MAX_LEVEL)
+# as long as the template keeps at least MATCH_PYRAMID_MIN_SIZE pixels on its smaller side
+MATCH_PYRAMID_MAX_LEVEL = 2
+MATCH_PYRAMID_MIN_SIZE = 24
+# how much lower the coarse level confidence may be than the template threshold before the full resolution refine
+MATCH_PYRAMID_COARSE_SLACK = 0.15
+
+# threads used to match several templates against the same screen
+MATCH_THREADS = 4
+
+# how many loaded templates are kept in memory, see cv.load_template
+TEMPLATE_CACHE_SIZE = 256
+# load every template under IMAGE_ROOT when api.auto_setup is called
+PRELOAD_TEMPLATES = True
+
+# a template is first searched around where it was last seen, widened by this fraction of its size on each side
+MATCH_LAST_SEEN_MARGIN = 1.0
+
+# loop_find only matches again when the screen has changed: the screen is reduced to a FRAME_SIGNATURE_SIZE square
+# thumbnail and has changed when a thumbnail pixel differs by more than FRAME_CHANGE_THRESHOLD
+FRAME_SIGNATURE_SIZE = 64
+FRAME_CHANGE_THRESHOLD = 2
+
+# screens logged by cv.log_screen and Android.snapshot(file_path) are written by a background thread
+SCREEN_LOG_ASYNC = True
+# screens waiting to be written, more are dropped
+SCREEN_LOG_QUEUE_SIZE = 32
+# downscale factor and jpg quality (None keeps the minicap jpg as is) of logged screens
+SCREEN_LOG_SCALE = 1
+SCREEN_LOG_QUALITY = None
+# screens kept per directory, the oldest written ones are removed, 0 keeps them all
+SCREEN_LOG_RETENTION = 0
+# seconds to wait at exit for queued screens to be written
+SCREEN_LOG_FLUSH_TIMEOUT = 10
+
+# seconds Android.state() snapshots are reused for, 0 to query the device every time
+STATE_CACHE_TTL = 1
+# moves per second and easing (see minitouch.gesture.EASINGS) of swipes, at full speed when lifting so they fling
+SWIPE_RATE = 100
+SWIPE_EASING = 'linear'
+# easing of drags, pinches and rotations, slowing down before lifting so nothing flings
+DRAG_EASING = 'ease_in_out'
+
+# keep the display orientation current with a long-lived shell instead of reading it with `minicap -i`
+ROTATION_WATCHER = True
+# seconds between two orientation checks on the device, rounded up to whole seconds before Android 6
+ROTATION_WATCH_INTERVAL = 0.5
+# seconds to wait before restarting a watcher which has stopped, doubled up to the maximum while it keeps stopping
+ROTATION_WATCH_RESTART_DELAY = (1, 60)
+# probe the minitouch server and socket before every gesture and reconnect when they are gone
+MINITOUCH_HEALTH_CHECK = True
+# local ports handed out for adb forwards (minicap, minitouch), shared by all devices and processes of the host
+FORWARD_PORT_RANGE = (30000, 34000)
+# seconds a `adb forward --list` result is reused for
+FORWARD_LIST_TTL = 1
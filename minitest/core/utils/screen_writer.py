@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import atexit
+import os
+import threading
+import zlib
+from collections import deque, defaultdict
+from queue import Queue, Full
+
+import cv2
+
+from logger import get_logger
+from minitest.core import settings
+from minitest.core.cv2.img_utils import ImgUtils
+
+LOGGER = get_logger(__name__)
+
+
+class ScreenWriter(object):
+    """
+    Write screenshots from a background thread so evidence capture never blocks the test.
+
+    The queue is bounded (screens are dropped, not waited for, when it is full), a screen identical to the
+    previous one of the same directory is skipped, screens can be downscaled/recompressed before being written
+    and only the latest `retention` screens written per directory are kept.
+    """
+
+    def __init__(self, queue_size=None, scale=None, quality=None, retention=None):
+        self.scale = settings.SCREEN_LOG_SCALE if scale is None else scale
+        self.quality = settings.SCREEN_LOG_QUALITY if quality is None else quality
+        self.retention = settings.SCREEN_LOG_RETENTION if retention is None else retention
+
+        self._queue = Queue(maxsize=queue_size or settings.SCREEN_LOG_QUEUE_SIZE)
+        self._last_crc = {}
+        self._written = defaultdict(deque)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def write(self, file_path, screen):
+        """
+        Queue the jpg screen to be written to `file_path`
+
+        Returns:
+            False if the queue is full and the screen has been dropped
+
+        """
+        self._start()
+        try:
+            self._queue.put_nowait((file_path, screen))
+        except Full:
+            LOGGER.warning('screen log queue is full, {} dropped'.format(file_path))
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued screen has been written
+        """
+        if self._thread is None:
+            return
+        with self._queue.all_tasks_done:
+            self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout=timeout)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='screen-writer')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            file_path, screen = self._queue.get()
+            try:
+                self._write(file_path, screen)
+            except Exception as e:
+                LOGGER.error('can not write screen {}: {}'.format(file_path, e))
+            finally:
+                self._queue.task_done()
+
+    def _write(self, file_path, screen):
+        dir_path = os.path.dirname(file_path)
+
+        crc = zlib.crc32(screen)
+        if self._last_crc.get(dir_path) == crc:
+            return
+        self._last_crc[dir_path] = crc
+
+        if self.scale != 1 or self.quality:
+            img = ImgUtils.str2img(screen)
+            if self.scale != 1:
+                img = cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality] if self.quality else []
+            screen = cv2.imencode('.jpg', img, params)[1]
+
+        ImgUtils.imwrite(file_path, screen)
+
+        # without retention every screen is kept, the written ones are not tracked
+        if not self.retention:
+            return
+        written = self._written[dir_path]
+        written.append(file_path)
+        while len(written) > self.retention:
+            old_path = written.popleft()
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+_SCREEN_WRITER = None
+_SCREEN_WRITER_LOCK = threading.Lock()
+
+
+def get_screen_writer():
+    global _SCREEN_WRITER
+    with _SCREEN_WRITER_LOCK:
+        if _SCREEN_WRITER is None:
+            _SCREEN_WRITER = ScreenWriter()
+            atexit.register(_SCREEN_WRITER.flush, settings.SCREEN_LOG_FLUSH_TIMEOUT)
+        return _SCREEN_WRITER
+
+
+def write_screen(file_path, screen):
+    """
+    Write the jpg screen, in the background when settings.SCREEN_LOG_ASYNC is set
+    """
+    if settings.SCREEN_LOG_ASYNC:
+        get_screen_writer().write(file_path, screen)
+    else:
+        ImgUtils.imwrite(file_path, screen)
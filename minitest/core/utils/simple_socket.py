@@ -42,7 +42,7 @@ class SimpleClient(SimpleSocket):
     def send(self, msg, enc="UTF-8"):
         if self.save_messages:
             self.sent_messages.append([msg, enc, datetime.now()])
-        self.socket.send(msg.encode(enc))
+        self.socket.sendall(msg if isinstance(msg, bytes) else msg.encode(enc))
 
     def receive(self, msg_len=2048, enc="UTF-8"):
         msg = self.socket.recv(msg_len)
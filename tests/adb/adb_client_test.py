@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+from minitest.core.android.adb.adb_client import AdbClient
+from minitest.core.android.adb.exceptions import AdbException
+
+
+class FakeAdbServer(object):
+    """
+    adb server on a local port answering the few requests the tests make, every request is recorded
+    """
+
+    def __init__(self, features='shell_v2,cmd'):
+        self.features = features
+        self.requests = []
+        self.pushed = {}
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(8)
+        self.port = self.server.getsockname()[1]
+
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.server.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self._handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def _recv_exactly(conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def _recv_request(self, conn):
+        request = self._recv_exactly(conn, int(self._recv_exactly(conn, 4), 16)).decode('utf-8')
+        self.requests.append(request)
+        return request
+
+    @staticmethod
+    def _okay(conn, answer=None):
+        if answer is None:
+            conn.sendall(b'OKAY')
+        else:
+            answer = answer.encode('utf-8')
+            conn.sendall(b'OKAY' + '{:04x}'.format(len(answer)).encode('ascii') + answer)
+
+    @staticmethod
+    def _fail(conn, message):
+        message = message.encode('utf-8')
+        conn.sendall(b'FAIL' + '{:04x}'.format(len(message)).encode('ascii') + message)
+
+    def _handle(self, conn):
+        try:
+            request = self._recv_request(conn)
+            if request == 'host:version':
+                self._okay(conn, '0029')
+            elif request.endswith(':features'):
+                self._okay(conn, self.features)
+            elif request == 'host:list-forward':
+                self._okay(conn, 'serial1 tcp:30000 localabstract:minicap_30000\n')
+            elif ':forward:' in request or ':killforward:' in request:
+                # the request is acknowledged, then the forward result is reported
+                conn.sendall(b'OKAYOKAY')
+            elif request.startswith('host:transport:'):
+                self._okay(conn)
+                self._device_service(conn, self._recv_request(conn))
+            else:
+                self._fail(conn, 'unknown request')
+        except EOFError:
+            pass
+        finally:
+            conn.close()
+
+    def _device_service(self, conn, service):
+        if service.startswith('shell,v2,raw:'):
+            self._okay(conn)
+            # the client closes stdin first
+            self.requests.append(struct.unpack('<BI', self._recv_exactly(conn, 5)))
+            for packet_id, data in ((1, b'out\n'), (2, b'err\n'), (3, b'\x01')):
+                conn.sendall(struct.pack('<BI', packet_id, len(data)) + data)
+        elif service.startswith('shell:'):
+            self._okay(conn)
+            conn.sendall(b'out\nerr\n')
+        elif service == 'sync:':
+            self._okay(conn)
+            self._sync(conn)
+        else:
+            self._fail(conn, 'unknown service')
+
+    def _sync(self, conn):
+        path, data = None, b''
+        while True:
+            cmd, length = struct.unpack('<4sI', self._recv_exactly(conn, 8))
+            if cmd == b'SEND':
+                path, data = self._recv_exactly(conn, length).decode('utf-8'), b''
+            elif cmd == b'DATA':
+                data += self._recv_exactly(conn, length)
+            elif cmd == b'DONE':
+                self.pushed[path] = data
+                conn.sendall(b'OKAY' + struct.pack('<I', 0))
+            else:
+                return
+
+
+class AdbClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAdbServer()
+        self.client = AdbClient(port=self.server.port, serial='serial1')
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_host_query(self):
+        self.assertEqual(self.client.version(), 0x29)
+        self.assertEqual(self.server.requests, ['host:version'])
+
+    def test_shell_v2(self):
+        self.assertEqual(self.client.shell('ls'), (b'out\n', b'err\n', 1))
+        self.assertEqual(self.server.requests,
+                         ['host-serial:serial1:features', 'host:transport:serial1', 'shell,v2,raw:ls', (3, 0)])
+
+    def test_shell_without_shell_v2(self):
+        self.server.features = 'cmd'
+        self.assertEqual(self.client.shell('ls'), (b'out\nerr\n', b'', None))
+        self.assertEqual(self.server.requests[-1], 'shell:exec </dev/null; ls')
+
+    def test_unknown_service(self):
+        with self.assertRaises(AdbException):
+            self.client.open_service('unknown:')
+
+    def test_push(self):
+        data = os.urandom(AdbClient.SYNC_DATA_MAX * 2 + 10)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(data)
+        try:
+            self.assertEqual(self.client.push(f.name, '/data/local/tmp/file', mode=0o755), len(data))
+            # the sync connection is pooled and reused by the next push
+            self.client.push(f.name, '/data/local/tmp/file2', mode=0o644)
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual(self.server.pushed['/data/local/tmp/file,493'], data)
+        self.assertEqual(self.server.pushed['/data/local/tmp/file2,420'], data)
+        self.assertEqual(self.server.requests.count('sync:'), 1)
+
+    def test_forward(self):
+        self.client.forward('tcp:30001', 'localabstract:minitouch_30001')
+        self.client.forward_remove('tcp:30001')
+        self.assertEqual(self.server.requests, [
+            'host-serial:serial1:forward:tcp:30001;localabstract:minitouch_30001',
+            'host-serial:serial1:killforward:tcp:30001',
+        ])
+        self.assertEqual(self.client.forward_list(),
+                         [('serial1', 'tcp:30000', 'localabstract:minicap_30000')])
+
+
+if __name__ == '__main__':
+    unittest.main()
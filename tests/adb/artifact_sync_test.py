@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from minitest.core.android.adb.artifact_sync import ArtifactSync
+from minitest.core.android.adb.exceptions import AdbException
+
+
+class FakeAdb(object):
+    """
+    Device whose files are a dict of path and content, `push_local_file` fails for the paths of `fail_push`
+    """
+
+    def __init__(self, serial='serial1'):
+        self.serial = serial
+        self.files = {}
+        self.packages = {}
+        self.fail_push = set()
+        self.commands = []
+        self.failed = False
+
+    def push_local_file(self, local, remote):
+        self.commands.append('push {}'.format(remote))
+        self.failed = remote in self.fail_push
+        if not self.failed:
+            with open(local, 'rb') as f:
+                self.files[remote] = f.read()
+
+    def shell_command(self, cmd):
+        self.commands.append(cmd)
+        self.failed = False
+        if cmd.startswith('md5sum '):
+            paths = cmd.split()[1:-1]
+            return ['{}  {}'.format(hashlib.md5(self.files[path]).hexdigest(), path)
+                    for path in paths if path in self.files] or None
+        if cmd.startswith('p=$(pm path '):
+            package = cmd.split()[2]
+            if package not in self.packages:
+                return None
+            return ['{}  /data/app/{}/base.apk'.format(hashlib.md5(self.packages[package]).hexdigest(), package)]
+        return None
+
+    def last_failed(self):
+        return self.failed
+
+    def get_error(self):
+        return 'failed' if self.failed else None
+
+
+class ArtifactSyncTest(unittest.TestCase):
+    def setUp(self):
+        ArtifactSync._device_md5.clear()
+        self.dir = tempfile.mkdtemp()
+        self.local = os.path.join(self.dir, 'minicap')
+        with open(self.local, 'wb') as f:
+            f.write(b'minicap binary')
+        self.adb = FakeAdb()
+        self.sync = ArtifactSync(self.adb)
+
+    def tearDown(self):
+        ArtifactSync._device_md5.clear()
+        shutil.rmtree(self.dir)
+
+    def test_push_once(self):
+        self.assertEqual(self.sync.push([(self.local, '/data/local/tmp/minicap')], mode=755),
+                         ['/data/local/tmp/minicap'])
+        self.assertIn('chmod 755 /data/local/tmp/minicap', self.adb.commands)
+
+        # known to be on the device, no adb call at all
+        del self.adb.commands[:]
+        self.assertEqual(ArtifactSync(self.adb).push([(self.local, '/data/local/tmp/minicap')], mode=755), [])
+        self.assertEqual(self.adb.commands, [])
+
+    def test_up_to_date_on_device(self):
+        self.adb.files['/data/local/tmp/minicap'] = b'minicap binary'
+        self.assertEqual(self.sync.push([(self.local, '/data/local/tmp/minicap')], mode=755), [])
+        self.assertNotIn('push /data/local/tmp/minicap', self.adb.commands)
+        self.assertIn('chmod 755 /data/local/tmp/minicap', self.adb.commands)
+
+    def test_failed_push_raises_and_is_retried(self):
+        self.adb.fail_push.add('/data/local/tmp/minicap')
+        with self.assertRaises(AdbException):
+            self.sync.push([(self.local, '/data/local/tmp/minicap')])
+
+        self.adb.fail_push.clear()
+        self.assertEqual(self.sync.push([(self.local, '/data/local/tmp/minicap')]), ['/data/local/tmp/minicap'])
+
+    def test_invalidate(self):
+        self.sync.push([(self.local, '/data/local/tmp/minicap')])
+        self.adb.files.clear()
+        self.sync.invalidate()
+        self.assertEqual(self.sync.push([(self.local, '/data/local/tmp/minicap')]), ['/data/local/tmp/minicap'])
+
+    def test_is_apk_installed(self):
+        self.assertFalse(self.sync.is_apk_installed(self.local, 'com.netease.nie.yosemite'))
+
+        self.adb.packages['com.netease.nie.yosemite'] = b'minicap binary'
+        self.assertTrue(self.sync.is_apk_installed(self.local, 'com.netease.nie.yosemite'))
+        del self.adb.commands[:]
+        self.assertTrue(self.sync.is_apk_installed(self.local, 'com.netease.nie.yosemite'))
+        self.assertEqual(self.adb.commands, [])
+
+        self.sync.forget_apk('com.netease.nie.yosemite')
+        del self.adb.packages['com.netease.nie.yosemite']
+        self.assertFalse(self.sync.is_apk_installed(self.local, 'com.netease.nie.yosemite'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from minitest.core.android.device_query import DeviceQuery, PROBES
+
+
+class FakeAdb(object):
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.commands = []
+
+    def shell_command(self, cmd):
+        self.commands.append(cmd)
+        return self.outputs
+
+
+class DeviceQueryTest(unittest.TestCase):
+    def test_build_script_merges_sources(self):
+        script, sources = DeviceQuery.build_script([PROBES['screen_on'], PROBES['top_activity'], PROBES['locked']])
+
+        self.assertEqual(sources, ['dumpsys window policy', 'dumpsys activity top'])
+        self.assertEqual(script, "echo '##minitest-query:0##'; dumpsys window policy | grep -E "
+                                 "'mScreenOnFully=|screenState=|mShowingLockscreen=|isStatusBarKeyguard='; "
+                                 "echo '##minitest-query:1##'; dumpsys activity top | grep -m 1 -E 'ACTIVITY '")
+
+    def test_build_script_without_filter(self):
+        script, _ = DeviceQuery.build_script([PROBES['display_info']])
+        self.assertNotIn('grep', script)
+
+    def test_query(self):
+        adb = FakeAdb([
+            '##minitest-query:0##',
+            'mScreenOnFully=true mOrientationSensorEnabled=false',
+            'mShowingLockscreen=false mShowingDream=false',
+            '##minitest-query:1##',
+            '  ACTIVITY com.android.settings/.Settings 3c2f9e0 pid=1234',
+        ])
+        values = DeviceQuery(adb).query('screen_on', 'locked', 'top_activity', 'keyboard_shown')
+
+        self.assertEqual(len(adb.commands), 1)
+        self.assertEqual(values, {
+            'screen_on': True,
+            'locked': False,
+            'top_activity': ['com.android.settings', '.Settings', '1234'],
+            # its section is missing from the output
+            'keyboard_shown': None,
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import unittest
+
+from minitest.core.android.android import Android
+from minitest.core.android.device_query import DeviceQuery, DeviceState, prop_probe
+
+DISPLAY_INFO = '{"width": 1080, "height": 1920, "rotation": 0, "orientation": 0}'
+
+
+class FakeAdb(object):
+    """
+    Answer a query script with the output of every source (unfiltered), under its section marker
+    """
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.commands = []
+
+    def shell_command(self, cmd):
+        self.commands.append(cmd)
+        lines = []
+        for index, source in re.findall(r"echo '##minitest-query:(\d+)##'; ([^|;]+)", cmd):
+            lines.append('##minitest-query:{}##'.format(index))
+            lines.extend(self.outputs.get(source.strip(), []))
+        return lines
+
+
+class FakeRotationWatcher(object):
+    orientation = None
+
+
+class DeviceStateTest(unittest.TestCase):
+    def setUp(self):
+        self.adb = FakeAdb({
+            'dumpsys window policy': ['mScreenOnFully=true'],
+            'dumpsys activity top': ['  ACTIVITY com.android.settings/.Settings 3c2f9e0 pid=1234'],
+            'LD_LIBRARY_PATH=/data/local/tmp /data/local/tmp/minicap -i 2>/dev/null': [DISPLAY_INFO],
+            'getprop': ['[ro.build.version.sdk]: [28]', '[ro.product.model]: [Pixel]'],
+        })
+        # a device without a connection, only what state() uses
+        self.android = Android.__new__(Android)
+        self.android.adb = self.adb
+        self.android.device_query = DeviceQuery(self.adb)
+        self.android.rotation_watcher = FakeRotationWatcher()
+        self.android._state = {}
+
+    def test_prop_probe(self):
+        values = DeviceQuery(self.adb).query(props=prop_probe(['ro.build.version.sdk', 'ro.missing']))
+        self.assertEqual(values, {'props': {'ro.build.version.sdk': '28'}})
+        self.assertIn("getprop | grep -E '^\\[ro\\.build\\.version\\.sdk\\]|^\\[ro\\.missing\\]'",
+                      self.adb.commands[0])
+
+    def test_state(self):
+        state = self.android.state(props=['ro.build.version.sdk'])
+
+        self.assertIsInstance(state, DeviceState)
+        self.assertEqual(len(self.adb.commands), 1)
+        self.assertTrue(state.screen_on)
+        # not reported by the device
+        self.assertIsNone(state.locked)
+        self.assertIsNone(state.keyboard_shown)
+        self.assertEqual(state.top_activity, ['com.android.settings', '.Settings', '1234'])
+        self.assertEqual(state.display_info['rotation'], 0)
+        self.assertEqual(state.props, {'ro.build.version.sdk': '28'})
+
+    def test_state_cached(self):
+        state = self.android.state(max_age=10)
+        self.assertIs(self.android.state(max_age=10), state)
+        self.assertIsNot(self.android.state(max_age=0), state)
+        self.assertEqual(len(self.adb.commands), 2)
+
+    def test_state_orientation_of_the_watcher(self):
+        self.android.rotation_watcher.orientation = 1
+        display_info = self.android.state().display_info
+        self.assertEqual((display_info['rotation'], display_info['orientation']), (90, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
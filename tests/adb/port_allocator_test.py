@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from minitest.core.android.adb.exceptions import AdbException
+from minitest.core.android.adb.port_allocator import PortAllocator, _file_lock
+
+
+class FakeAdb(object):
+    def __init__(self, serial, forwards):
+        self.serial = serial
+        self.forwards = forwards
+        self.removed = []
+
+    def forward_list(self):
+        return list(self.forwards)
+
+    def forward_socket(self, local, remote):
+        self.forwards.append((self.serial, local, remote))
+
+    def forward_remove(self, local):
+        self.removed.append(local)
+        self.forwards[:] = [f for f in self.forwards if f[1] != local]
+
+    def last_failed(self):
+        return False
+
+    def get_error(self):
+        return None
+
+
+class PortAllocatorTest(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.forwards = []
+        self.allocator = PortAllocator(port_range=(34100, 34110), state_dir=self.state_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def registry(self):
+        with open(self.allocator.registry_path) as f:
+            return json.load(f)
+
+    def test_allocate(self):
+        adb = FakeAdb('serial1', self.forwards)
+        port, name = self.allocator.allocate(adb, 'minicap')
+
+        self.assertTrue(34100 <= port < 34110)
+        self.assertEqual(name, 'minicap_{}'.format(port))
+        self.assertIn(('serial1', 'tcp:{}'.format(port), 'localabstract:minicap_{}'.format(port)), self.forwards)
+        self.assertEqual(self.registry()[str(port)]['pid'], os.getpid())
+
+    def test_no_collision_between_devices(self):
+        ports = [self.allocator.allocate(FakeAdb(serial, self.forwards), 'minitouch')[0]
+                 for serial in ('serial1', 'serial2', 'serial3')]
+        self.assertEqual(len(set(ports)), 3)
+
+    def test_no_collision_between_processes(self):
+        port, _ = self.allocator.allocate(FakeAdb('serial1', []), 'minicap')
+        # another process with its own allocator and without the forward list of the first one
+        other = PortAllocator(port_range=(34100, 34110), state_dir=self.state_dir)
+        ports = set(other.allocate(FakeAdb('serial2', []), 'minicap')[0] for _ in range(9))
+        self.assertNotIn(port, ports)
+
+    def test_reuse_leaked_forward(self):
+        self.forwards.append(('serial1', 'tcp:34105', 'localabstract:minicap_34105'))
+        adb = FakeAdb('serial1', self.forwards)
+
+        self.assertEqual(self.allocator.allocate(adb, 'minicap'), (34105, 'minicap_34105'))
+        self.assertEqual(len(self.forwards), 1)
+
+    def test_release(self):
+        adb = FakeAdb('serial1', self.forwards)
+        port, _ = self.allocator.allocate(adb, 'minicap')
+        self.allocator.release(port)
+
+        self.assertEqual(adb.removed, ['tcp:{}'.format(port)])
+        self.assertEqual(self.registry(), {})
+
+    def test_dead_process_entries_dropped(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        with open(self.allocator.registry_path, 'w') as f:
+            json.dump({str(port): {'pid': process.pid, 'serial': 'serial1', 'remote': 'localabstract:x'}
+                       for port in range(34100, 34110)}, f)
+
+        port, _ = self.allocator.allocate(FakeAdb('serial1', self.forwards), 'minicap')
+        self.assertEqual(list(self.registry()), [str(port)])
+
+    def test_lock_of_a_dead_process_released(self):
+        # the lock file is left behind, the lock itself goes with the process
+        holder = subprocess.Popen([sys.executable, '-c', 'import sys, time; '
+                                   'from minitest.core.android.adb.port_allocator import _file_lock\n'
+                                   'with _file_lock(sys.argv[1]):\n print("locked", flush=True); time.sleep(60)',
+                                   self.allocator.lock_path], stdout=subprocess.PIPE)
+        try:
+            self.assertEqual(holder.stdout.readline(), b'locked\n')
+            with self.assertRaises(AdbException):
+                with _file_lock(self.allocator.lock_path, timeout=0.2):
+                    pass
+        finally:
+            holder.kill()
+            holder.wait()
+            holder.stdout.close()
+
+        start = time.time()
+        self.allocator.allocate(FakeAdb('serial1', self.forwards), 'minicap')
+        self.assertLess(time.time() - start, 1)
+
+    def test_no_free_port(self):
+        adb = FakeAdb('serial1', self.forwards)
+        for _ in range(10):
+            self.allocator.allocate(adb, 'minicap')
+        with self.assertRaises(AdbException):
+            self.allocator.allocate(adb, 'minicap')
+
+
+if __name__ == '__main__':
+    unittest.main()
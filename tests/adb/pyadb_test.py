@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import socket
+import subprocess
+import threading
+import time
+import unittest
+
+from minitest.core.android.adb.pyadb import ADB, PROPERTY_PATTERN
+
+GETPROP = [
+    '[ro.product.cpu.abi]: [arm64-v8a]',
+    '[ro.build.version.sdk]: [28]',
+    '[persist.sys.multi]: [line 1',
+    'line 2]',
+    '[ro.empty]: []',
+]
+
+
+class PropertyPatternTest(unittest.TestCase):
+    def test_getprop_dump(self):
+        self.assertEqual(dict(PROPERTY_PATTERN.findall('\n'.join(GETPROP))), {
+            'ro.product.cpu.abi': 'arm64-v8a',
+            'ro.build.version.sdk': '28',
+            'persist.sys.multi': 'line 1\nline 2',
+            'ro.empty': '',
+        })
+
+
+class PropertiesTest(unittest.TestCase):
+    def setUp(self):
+        self.adb = ADB(serial='serial1', native=False)
+        self.commands = []
+        self.outputs = [GETPROP]
+
+        def shell_command(cmd):
+            self.commands.append(cmd)
+            return self.outputs.pop(0)
+
+        self.adb.shell_command = shell_command
+
+    def test_one_dump(self):
+        self.assertEqual(self.adb.getprop('ro.build.version.sdk'), '28')
+        self.assertEqual(self.adb.getprop('ro.product.cpu.abi'), 'arm64-v8a')
+        self.assertIsNone(self.adb.getprop('ro.missing'))
+        self.assertEqual(self.commands, ['getprop'])
+
+    def test_failed_dump_not_cached(self):
+        self.outputs.insert(0, None)
+        self.assertIsNone(self.adb.getprop('ro.build.version.sdk'))
+        self.assertEqual(self.adb.getprop('ro.build.version.sdk'), '28')
+        self.assertEqual(self.commands, ['getprop', 'getprop'])
+
+    def test_invalidate(self):
+        self.outputs.append(['[ro.build.version.sdk]: [29]'])
+        self.adb.get_properties()
+        self.adb.invalidate_properties()
+        self.assertEqual(self.adb.getprop('ro.build.version.sdk'), '29')
+
+
+class ShellSearchTest(unittest.TestCase):
+    def test_binary_command_killed_once_found(self):
+        adb = ADB(serial='serial1', native=False)
+        processes = []
+
+        def shell_command_ext(cmd):
+            processes.append(subprocess.Popen(['sh', '-c', cmd], stdout=subprocess.PIPE))
+            return processes[-1]
+
+        adb.shell_command_ext = shell_command_ext
+        start = time.time()
+        self.assertEqual(adb.shell_search('echo a; echo b; sleep 10; echo c', lambda line: line == 'b'), 'b')
+        self.assertLess(time.time() - start, 5)
+        self.assertIsNotNone(processes[0].poll())
+
+    def test_native_connection_closed_once_found(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        services = []
+        closed = threading.Event()
+
+        def serve():
+            conn, _ = server.accept()
+            for _ in range(2):
+                services.append(conn.recv(int(conn.recv(4), 16)).decode('utf-8'))
+                conn.sendall(b'OKAY')
+            conn.sendall(b'a\nb\n')
+            # the rest of the output is never sent, the client has to close the connection
+            if conn.recv(1) == b'':
+                closed.set()
+            conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+
+        adb = ADB(host='127.0.0.1', port=server.getsockname()[1], serial='serial1', native=True)
+        try:
+            self.assertEqual(adb.shell_search('logcat', lambda line: line == 'b'), 'b')
+            self.assertTrue(closed.wait(1.0))
+            self.assertEqual(services, ['host:transport:serial1', 'shell:exec </dev/null; logcat'])
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
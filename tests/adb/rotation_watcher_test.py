@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import subprocess
+import time
+import unittest
+from unittest import mock
+
+from minitest.core import settings
+from minitest.core.android.rotation_watcher import RotationWatcher
+
+
+class FakeAdb(object):
+    """
+    Run a local shell script in place of the watcher script, every device command is recorded
+    """
+
+    def __init__(self, sdk_version='29', script='echo rotation:1'):
+        self.sdk_version = sdk_version
+        self.script = script
+        self.commands = []
+
+    def getprop(self, name):
+        return self.sdk_version if name == 'ro.build.version.sdk' else ''
+
+    def shell_command_ext(self, cmd):
+        self.commands.append(cmd)
+        if self.script is None:
+            return None
+        return subprocess.Popen(['sh', '-c', self.script], stdout=subprocess.PIPE)
+
+    def get_error(self):
+        return 'no device'
+
+
+class RotationWatcherTest(unittest.TestCase):
+    def wait_stopped(self, watcher):
+        deadline = time.time() + 5
+        while watcher.process is not None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIsNone(watcher.process)
+
+    def test_fractional_interval(self):
+        adb = FakeAdb(sdk_version='23')
+        RotationWatcher(adb, interval=0.5).start()
+        self.assertTrue(adb.commands[0].endswith('sleep 0.5; done'))
+
+    def test_whole_second_interval_before_toybox(self):
+        adb = FakeAdb(sdk_version='21')
+        RotationWatcher(adb, interval=0.5).start()
+        self.assertTrue(adb.commands[0].endswith('sleep 1; done'))
+
+    def test_orientation(self):
+        adb = FakeAdb(script='echo rotation:1; sleep 5')
+        watcher = RotationWatcher(adb)
+        self.assertTrue(watcher.start())
+        self.assertFalse(watcher.start())
+        self.assertEqual(watcher.wait_for_orientation(timeout=5), 1)
+        watcher.stop()
+        self.assertIsNone(watcher.orientation)
+
+    @mock.patch.object(settings, 'ROTATION_WATCH_RESTART_DELAY', (0.2, 0.4))
+    def test_restart_back_off(self):
+        adb = FakeAdb()
+        watcher = RotationWatcher(adb)
+        self.assertTrue(watcher.start())
+        self.wait_stopped(watcher)
+
+        # the watcher has ended by itself, it is not started again right away
+        self.assertFalse(watcher.start())
+        self.assertEqual(len(adb.commands), 1)
+        time.sleep(0.25)
+        self.assertTrue(watcher.start())
+        self.wait_stopped(watcher)
+
+        # the delay doubles up to the maximum
+        self.assertEqual(watcher._restart_delay, 0.4)
+        time.sleep(0.25)
+        self.assertFalse(watcher.start())
+        time.sleep(0.2)
+        self.assertTrue(watcher.start())
+        self.assertEqual(len(adb.commands), 3)
+
+    @mock.patch.object(settings, 'ROTATION_WATCH_RESTART_DELAY', (10, 60))
+    def test_failed_start_back_off(self):
+        adb = FakeAdb(script=None)
+        watcher = RotationWatcher(adb)
+        self.assertFalse(watcher.start())
+        self.assertFalse(watcher.start())
+        self.assertEqual(len(adb.commands), 1)
+
+        # stopping the watcher resets the delay
+        watcher.stop()
+        adb.script = 'sleep 5'
+        self.assertTrue(watcher.start())
+        watcher.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from minitest.core import cv
+from minitest.core.error import TargetNotFoundError
+from minitest.core.helper import bind_device
+
+
+def png(level):
+    return cv2.imencode('.png', np.full((320, 180), level, np.uint8))[1].tobytes()
+
+
+class FakeDevice(object):
+    """
+    Device showing `frames` one after the other, then the last one
+    """
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def snapshot(self):
+        return self.frames.pop(0) if len(self.frames) > 1 else self.frames[0]
+
+    def wait_for_frame(self, timeout):
+        time.sleep(0.001)
+
+
+class FrameChangeTest(unittest.TestCase):
+    def test_signature(self):
+        signature = cv.frame_signature(np.full((320, 180), 100, np.uint8))
+        self.assertEqual(signature.shape, (64, 64))
+        self.assertFalse(cv.frame_changed(signature, cv.frame_signature(np.full((320, 180), 102, np.uint8))))
+        self.assertTrue(cv.frame_changed(signature, cv.frame_signature(np.full((320, 180), 103, np.uint8))))
+
+    def searched_frames(self, frames):
+        searched = []
+
+        def match_all(templates, screen_gray):
+            searched.append(int(screen_gray[0, 0]))
+            return {}
+
+        template = mock.Mock(spec=cv.Template)
+        with bind_device(FakeDevice(frames)), mock.patch.object(cv, 'match_all', match_all), \
+                mock.patch.object(cv, 'log_screen'):
+            with self.assertRaises(TargetNotFoundError):
+                cv.loop_find_any([template], time_out=0.1)
+        return searched
+
+    def test_same_frame_searched_once(self):
+        self.assertEqual(self.searched_frames([png(100), png(100), png(100)]), [100])
+
+    def test_slow_change_adds_up(self):
+        # every frame differs from the previous one by less than the threshold, the change is noticed once it
+        # adds up since the last searched frame
+        self.assertEqual(self.searched_frames([png(level) for level in range(100, 110)]), [100, 103, 106, 109])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from config import TESTS_ROOT
+from minitest.core import cv, settings
+
+# templates and the screens they have been captured from
+PAIRS = [(path[:-len('_screen.png')] + '.png', path)
+         for path in sorted(glob.glob(os.path.join(TESTS_ROOT, 'ui_eg', 'test_airtest.air', '*_screen.png')))]
+
+
+def read_gray(path):
+    return cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY)
+
+
+def plain_match(screen_gray, tpl_gray):
+    res = cv2.matchTemplate(screen_gray, tpl_gray, cv2.TM_CCOEFF_NORMED)
+    _, max_val, _, max_loc = cv2.minMaxLoc(res)
+    h, w = tpl_gray.shape[:2]
+    return (max_loc[0] + w / 2, max_loc[1] + h / 2), max_val
+
+
+class MatchTest(unittest.TestCase):
+    def setUp(self):
+        cv._LAST_SEEN.clear()
+
+    def assertSameMatch(self, template, screen_gray, expected_pos, expected_val):
+        pos, val = template.match_with_confidence(screen_gray)
+        self.assertIsNotNone(pos, template)
+        self.assertLessEqual(abs(pos[0] - expected_pos[0]) + abs(pos[1] - expected_pos[1]), 2, template)
+        self.assertAlmostEqual(val, expected_val, delta=0.02, msg=str(template))
+
+    def test_pyramid_matches_plain(self):
+        self.assertTrue(PAIRS)
+        for tpl_path, screen_path in PAIRS:
+            screen_gray = read_gray(screen_path)
+            expected_pos, expected_val = plain_match(screen_gray, read_gray(tpl_path))
+            if expected_val < 0.8:
+                continue
+            self.assertSameMatch(cv.Template(tpl_path), screen_gray, expected_pos, expected_val)
+
+    def test_region_of_the_template_size(self):
+        for tpl_path, screen_path in PAIRS:
+            screen_gray = read_gray(screen_path)
+            tpl_gray = read_gray(tpl_path)
+            (x, y), expected_val = plain_match(screen_gray, tpl_gray)
+            if expected_val < 0.8:
+                continue
+            h, w = tpl_gray.shape[:2]
+            x0, y0 = int(x - w / 2), int(y - h / 2)
+            template = cv.Template(tpl_path, region=(x0, y0, x0 + w, y0 + h))
+            self.assertSameMatch(template, screen_gray, (x, y), expected_val)
+
+    def test_region_of_a_large_template(self):
+        # textured, so a coarse match of the wrong size scores low, and large enough to be matched coarse-to-fine
+        noise = np.random.RandomState(0).randint(0, 256, (600, 400)).astype(np.uint8)
+        screen_gray = cv2.GaussianBlur(noise, (5, 5), 0)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for w, h in ((99, 99), (99, 50)):
+                tpl_path = os.path.join(tmp_dir, 'tpl_{}x{}.png'.format(w, h))
+                cv2.imwrite(tpl_path, screen_gray[100:100 + h, 100:100 + w])
+                template = cv.Template(tpl_path, region=(100, 100, 100 + w, 100 + h))
+                self.assertGreater(template.image.pyramid_level(1.0), 0)
+                self.assertSameMatch(template, screen_gray, (100 + w / 2, 100 + h / 2), 1.0)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_not_found(self):
+        tpl_path, screen_path = PAIRS[0]
+        screen_gray = read_gray(screen_path)
+        pos, _ = cv.Template(tpl_path, threshold=1.01).match_with_confidence(screen_gray)
+        self.assertIsNone(pos)
+        with self.assertRaises(ValueError):
+            cv.Template(tpl_path, region=(10, 10, 10, 20)).match_with_confidence(screen_gray)
+
+
+class PreloadTemplatesTest(unittest.TestCase):
+    def setUp(self):
+        cv._load_template.cache_clear()
+        self.root = tempfile.mkdtemp()
+        for template, _ in PAIRS[:3]:
+            shutil.copy(template, self.root)
+        with open(os.path.join(self.root, 'broken.png'), 'wb') as f:
+            f.write(b'not a png')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        cv._load_template.cache_clear()
+
+    def test_unreadable_template_skipped(self):
+        self.assertEqual(cv.preload_templates(self.root), 3)
+        self.assertEqual(cv._load_template.cache_info().currsize, 3)
+
+    @mock.patch.object(settings, 'TEMPLATE_CACHE_SIZE', 2)
+    def test_stops_when_the_cache_is_full(self):
+        self.assertEqual(cv.preload_templates(self.root), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import socket
+import struct
+import threading
+import unittest
+
+from minitest.core.android.minicap.exceptions import MinicapException
+from minitest.core.android.minicap.minicap import MinicapStream, Minicap
+
+
+def banner(orientation=1):
+    return struct.pack(MinicapStream.BANNER_FORMAT, 1, MinicapStream.BANNER_SIZE, 1234, 1080, 1920, 540, 960,
+                       orientation, 0)
+
+
+def frame(data):
+    return struct.pack('<I', len(data)) + data
+
+
+class MinicapStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.device, sock = socket.socketpair()
+        self.stream = MinicapStream(None, '/data/local/tmp', {'width': 1080, 'height': 1920, 'rotation': 0},
+                                    buffer_size=2)
+        self.stream.socket = sock
+
+    def tearDown(self):
+        self.device.close()
+        self.stream.socket.close()
+
+    def start_reading(self):
+        self.stream._thread = threading.Thread(target=self.stream._read_frames)
+        self.stream._thread.daemon = True
+        self.stream._thread.start()
+
+    def test_parse_banner(self):
+        self.assertEqual(MinicapStream._parse_banner(banner()), {
+            'version': 1,
+            'pid': 1234,
+            'real_width': 1080,
+            'real_height': 1920,
+            'virtual_width': 540,
+            'virtual_height': 960,
+            'orientation': 90,
+            'quirks': 0,
+        })
+
+    def test_parse_bad_banner(self):
+        data = struct.pack(MinicapStream.BANNER_FORMAT, 1, 10, 1234, 1080, 1920, 540, 960, 0, 0)
+        with self.assertRaises(MinicapException):
+            MinicapStream._parse_banner(data)
+
+    def test_recv_exactly_split(self):
+        self.device.sendall(b'ab')
+        threading.Timer(0.05, self.device.sendall, args=(b'cd',)).start()
+        self.assertEqual(bytes(MinicapStream._recv_exactly(self.stream.socket, 4)), b'abcd')
+
+    def test_recv_exactly_closed(self):
+        self.device.sendall(b'ab')
+        self.device.close()
+        with self.assertRaises(MinicapException):
+            MinicapStream._recv_exactly(self.stream.socket, 4)
+
+    def test_frames(self):
+        self.start_reading()
+        self.device.sendall(frame(b'jpg1') + frame(b'jpg2'))
+        self.assertTrue(self.stream.wait_for_frame(1.0))
+        self.assertIn(bytes(self.stream.get_frame()), (b'jpg1', b'jpg2'))
+
+        # the latest frame is returned, nothing newer until the next one is received
+        self.stream.wait_for_frame(0.1)
+        self.assertEqual(bytes(self.stream.get_frame()), b'jpg2')
+        self.assertFalse(self.stream.wait_for_frame(0.1))
+
+        self.device.sendall(frame(b'jpg3'))
+        self.assertTrue(self.stream.wait_for_frame(1.0))
+        self.assertEqual(bytes(self.stream.get_frame()), b'jpg3')
+        self.assertEqual(len(self.stream.frames), 2)
+
+    def test_closed(self):
+        self.start_reading()
+        self.device.close()
+        self.stream._thread.join(1.0)
+        self.assertFalse(self.stream.is_alive())
+        with self.assertRaises(MinicapException):
+            self.stream.get_frame(timeout=0.1)
+
+
+class FakeAdb(object):
+    def __init__(self):
+        self.commands = []
+
+    def getprop(self, key):
+        return '28'
+
+    def exec_out(self, cmd):
+        self.commands.append(cmd)
+        return b'jpg'
+
+
+class MinicapFallbackTest(unittest.TestCase):
+    def test_stream_failure_is_remembered(self):
+        adb = FakeAdb()
+        minicap = Minicap(adb, lambda: {'width': 1080, 'height': 1920, 'rotation': 0})
+        minicap._install_ready = True
+        starts = []
+
+        def get_stream_frame():
+            starts.append(1)
+            raise MinicapException('minicap server quit immediately')
+
+        minicap.get_stream_frame = get_stream_frame
+        self.assertEqual(minicap.get_frame(), b'jpg')
+        self.assertEqual(minicap.get_frame(), b'jpg')
+        self.assertEqual(len(starts), 1)
+        self.assertEqual(len(adb.commands), 2)
+
+        minicap.enable_stream()
+        minicap.get_frame()
+        self.assertEqual(len(starts), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
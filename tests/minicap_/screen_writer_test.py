@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from minitest.core.utils.screen_writer import ScreenWriter
+
+
+class ScreenWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name, sub_dir=''):
+        os.makedirs(os.path.join(self.dir, sub_dir), exist_ok=True)
+        return os.path.join(self.dir, sub_dir, name)
+
+    def files(self, sub_dir=''):
+        return sorted(f for f in os.listdir(os.path.join(self.dir, sub_dir))
+                      if os.path.isfile(os.path.join(self.dir, sub_dir, f)))
+
+    def test_write_in_background(self):
+        writer = ScreenWriter(retention=0)
+        for i in range(3):
+            self.assertTrue(writer.write(self.path('{}.jpg'.format(i)), 'screen {}'.format(i).encode()))
+        writer.flush(timeout=5)
+        self.assertEqual(self.files(), ['0.jpg', '1.jpg', '2.jpg'])
+        with open(self.path('1.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), b'screen 1')
+
+    def test_same_screen_skipped(self):
+        writer = ScreenWriter(retention=0)
+        writer._write(self.path('0.jpg'), b'screen')
+        writer._write(self.path('1.jpg'), b'screen')
+        writer._write(self.path('2.jpg'), b'other screen')
+        writer._write(self.path('3.jpg'), b'screen')
+        # the previous screen is per directory
+        writer._write(self.path('0.jpg', 'other'), b'screen')
+
+        self.assertEqual(self.files(), ['0.jpg', '2.jpg', '3.jpg'])
+        self.assertEqual(self.files('other'), ['0.jpg'])
+
+    def test_retention(self):
+        writer = ScreenWriter(retention=2)
+        for i in range(5):
+            writer._write(self.path('{}.jpg'.format(i)), 'screen {}'.format(i).encode())
+        self.assertEqual(self.files(), ['3.jpg', '4.jpg'])
+
+    def test_no_retention(self):
+        writer = ScreenWriter(retention=0)
+        for i in range(5):
+            writer._write(self.path('{}.jpg'.format(i)), 'screen {}'.format(i).encode())
+        self.assertEqual(len(self.files()), 5)
+        # nothing is removed, nothing is tracked
+        self.assertEqual(dict(writer._written), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from minitest.core.android.minitouch.gesture import Gesture
+
+
+class GestureTest(unittest.TestCase):
+    def test_tap(self):
+        self.assertEqual(Gesture().tap(10, 20).to_lines(), ['d 0 10 20 50', 'c', 'w 10', 'u 0', 'c'])
+
+    def test_to_bytes(self):
+        gesture = Gesture(pressure=30).down(1, 10.4, 20.6).commit()
+        self.assertEqual(gesture.to_bytes(), b'd 1 10 21 30\nc\n')
+        self.assertEqual(gesture.contacts, {1})
+
+    def test_wait(self):
+        gesture = Gesture().wait(0.4).wait(10.6).wait(0)
+        self.assertEqual(gesture.to_lines(), ['w 11'])
+        self.assertEqual(gesture.duration, 11)
+
+    def test_extend(self):
+        gesture = Gesture().tap(1, 1).extend(Gesture().tap(2, 2, contact=1))
+        self.assertEqual(gesture.duration, 20)
+        self.assertEqual(gesture.contacts, {0, 1})
+        self.assertEqual(len(gesture), 10)
+
+    def test_reset(self):
+        self.assertEqual(Gesture().reset().to_bytes(), b'r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
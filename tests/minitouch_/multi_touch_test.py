@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from minitest.core.android.minitouch.gesture import Gesture
+
+
+class MultiTouchTest(unittest.TestCase):
+    def test_pinch(self):
+        gesture = Gesture().pinch((100, 100), 10, 50, duration=100, steps=2)
+        lines = gesture.to_lines()
+
+        self.assertEqual(gesture.contacts, {0, 1})
+        self.assertEqual(lines[:3], ['d 0 110 100 50', 'd 1 90 100 50', 'c'])
+        self.assertEqual(lines[-6:], ['m 0 150 100 50', 'm 1 50 100 50', 'c', 'u 0', 'u 1', 'c'])
+
+    def test_pinch_fingers(self):
+        gesture = Gesture().pinch((100, 100), 50, 10, fingers=4, duration=100, steps=1)
+        self.assertEqual(gesture.to_lines()[:5],
+                         ['d 0 150 100 50', 'd 1 100 150 50', 'd 2 50 100 50', 'd 3 100 50 50', 'c'])
+
+    def test_rotate(self):
+        # a quarter turn, clockwise on the screen (y goes down)
+        lines = Gesture().rotate((100, 100), 50, 90, duration=100, steps=1).to_lines()
+        self.assertEqual(lines[:3], ['d 0 150 100 50', 'd 1 50 100 50', 'c'])
+        self.assertEqual(lines[4:7], ['m 0 100 150 50', 'm 1 100 50 50', 'c'])
+
+    def test_multi_swipe(self):
+        gesture = Gesture().multi_swipe([(0, 0), (10, 0)], [(0, 100), (10, 100)], duration=100, steps=2,
+                                        easing='linear', hold=30)
+        lines = gesture.to_lines()
+
+        self.assertEqual(gesture.duration, 130)
+        self.assertEqual(lines[:3], ['d 0 0 0 50', 'd 1 10 0 50', 'c'])
+        # both fingers move in the same commit
+        self.assertEqual(lines[4:7], ['m 0 0 50 50', 'm 1 10 50 50', 'c'])
+        self.assertEqual(lines[-4:], ['w 30', 'u 0', 'u 1', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
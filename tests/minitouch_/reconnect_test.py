@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+import unittest
+
+from minitest.core.android.minitouch.minitouch import Minitouch
+
+BANNER = b'v 1\n^ 10 4095 4095 255\n$ 123\n'
+
+
+class FakeMinitouchServer(object):
+    """
+    minitouch socket on a local port: sends the banner to every connection and records what it receives
+    """
+
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(4)
+        self.port = self.server.getsockname()[1]
+        self.connections = []
+        self.received = []
+        self._received = threading.Condition()
+
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except socket.error:
+                return
+            self.connections.append(conn)
+            conn.sendall(BANNER)
+            thread = threading.Thread(target=self._read, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _read(self, conn):
+        while True:
+            try:
+                data = conn.recv(4096)
+            except socket.error:
+                return
+            if not data:
+                return
+            with self._received:
+                self.received.append(data)
+                self._received.notify_all()
+
+    def wait_for(self, data, timeout=2.0):
+        with self._received:
+            return self._received.wait_for(lambda: data in b''.join(self.received), timeout=timeout)
+
+    def drop_connections(self):
+        for conn in self.connections:
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+
+    def close(self):
+        # wakes up the accept, the socket would keep listening until then
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.server.close()
+
+
+class FakeProcess(object):
+    def __init__(self):
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeMinitouchServer()
+        self.minitouch = Minitouch(None)
+        self.minitouch.local_port = self.server.port
+        self.minitouch.server_process = FakeProcess()
+        self.server_starts = []
+
+        def start_server():
+            self.server_starts.append(1)
+            self.minitouch.server_process = FakeProcess()
+
+        self.minitouch.start_server = start_server
+        self.minitouch.start_client()
+        self.minitouch._install_and_set_up_ready = True
+
+    def tearDown(self):
+        self.minitouch.kill_client()
+        self.server.close()
+
+    def test_banner(self):
+        self.assertEqual((self.minitouch.max_contacts, self.minitouch.max_x, self.minitouch.max_y), (10, 4095, 4095))
+        self.assertTrue(self.minitouch.is_healthy())
+
+    def test_send(self):
+        self.minitouch._send('d 0 10 10 50\nc\n')
+        self.assertTrue(self.server.wait_for(b'd 0 10 10 50\nc\n'))
+        self.assertEqual(self.minitouch.get_metrics()['sends'], 1)
+
+    def wait_unhealthy(self, timeout=2.0):
+        deadline = time.time() + timeout
+        while self.minitouch.is_healthy() and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_reconnect_after_drop(self):
+        self.server.drop_connections()
+        self.wait_unhealthy()
+        self.minitouch._send('u 0\nc\n')
+
+        self.assertTrue(self.server.wait_for(b'u 0\nc\n'))
+        self.assertEqual(len(self.server.connections), 2)
+        self.assertEqual(self.minitouch.get_metrics()['reconnects'], 1)
+        self.assertEqual(self.server_starts, [])
+
+    def test_restart_dead_server(self):
+        self.minitouch.server_process.kill()
+        self.minitouch._send('u 0\nc\n')
+
+        self.assertTrue(self.server.wait_for(b'u 0\nc\n'))
+        self.assertEqual(self.server_starts, [1])
+
+    def test_give_up(self):
+        # the server restarted by the reconnection can not be connected either
+        self.minitouch.server_process.kill()
+        self.server.close()
+        with self.assertRaises(RuntimeError):
+            self.minitouch._send('u 0\nc\n')
+        # set up again on the next call
+        self.assertFalse(self.minitouch._install_and_set_up_ready)
+
+
+if __name__ == '__main__':
+    unittest.main()
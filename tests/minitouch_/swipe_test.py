@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from minitest.core.android.minitouch.gesture import Gesture, EASINGS
+
+
+def moves(gesture):
+    return [tuple(int(v) for v in line.split()[2:4]) for line in gesture.to_lines() if line.startswith('m')]
+
+
+class SwipeTest(unittest.TestCase):
+    def test_swipe(self):
+        gesture = Gesture().swipe((0, 0), (100, 200), duration=300, rate=100, easing='linear', hold=50)
+        lines = gesture.to_lines()
+
+        self.assertEqual(gesture.duration, 350)
+        self.assertEqual(lines[:2], ['d 0 0 0 50', 'c'])
+        self.assertEqual(len(moves(gesture)), 30)
+        self.assertEqual(lines[-5:], ['m 0 100 200 50', 'c', 'w 50', 'u 0', 'c'])
+
+    def test_waits_add_up_to_duration(self):
+        gesture = Gesture().swipe((0, 0), (10, 10), duration=100, steps=3, easing='linear')
+        waits = [int(line.split()[1]) for line in gesture.to_lines() if line.startswith('w')]
+        self.assertEqual(waits, [33, 34, 33])
+
+    def test_press(self):
+        lines = Gesture().swipe((0, 0), (10, 10), duration=100, steps=2, press=200).to_lines()
+        self.assertEqual(lines[:3], ['d 0 0 0 50', 'c', 'w 200'])
+
+    def test_linear_steps_are_even(self):
+        self.assertEqual(moves(Gesture().swipe((0, 0), (100, 0), duration=100, steps=4, easing='linear')),
+                         [(25, 0), (50, 0), (75, 0), (100, 0)])
+
+    def test_easing(self):
+        for name, ease in EASINGS.items():
+            self.assertAlmostEqual(ease(0.0), 0.0, msg=name)
+            self.assertAlmostEqual(ease(1.0), 1.0, msg=name)
+            progress = [ease(i / 10.0) for i in range(11)]
+            self.assertEqual(progress, sorted(progress), name)
+
+        # fast in the middle, slow at the end
+        xs = [x for x, _ in moves(Gesture().swipe((0, 0), (100, 0), duration=100, steps=10, easing='ease_in_out'))]
+        self.assertLess(xs[-1] - xs[-2], xs[5] - xs[4])
+        self.assertEqual(xs[-1], 100)
+
+    def test_swipe_lifts_at_full_speed(self):
+        # a swipe has to fling, it does not slow down before lifting
+        self.assertEqual(moves(Gesture().swipe((0, 0), (100, 0), duration=100, steps=4)),
+                         [(25, 0), (50, 0), (75, 0), (100, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
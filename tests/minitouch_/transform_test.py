@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+
+from minitest.core.android.minitouch.gesture import Gesture
+from minitest.core.android.minitouch.transform import TouchTransform, get_touch_transform
+
+
+class TouchTransformTest(unittest.TestCase):
+    def test_scale(self):
+        transform = TouchTransform(1080, 1920, 0, 2160, 3840)
+        self.assertEqual(transform.point((540, 960)), (1080, 1920))
+
+    def test_rotation(self):
+        # screen positions are upright in the current rotation, touch positions in the natural orientation
+        width, height = 1080, 1920
+        self.assertEqual(TouchTransform(width, height, 90, width, height).point((0, 0)), (width, 0))
+        self.assertEqual(TouchTransform(width, height, 90, width, height).point((1920, 0)), (width, 1920))
+        self.assertEqual(TouchTransform(width, height, 180, width, height).point((0, 0)), (width, height))
+        self.assertEqual(TouchTransform(width, height, 270, width, height).point((0, 0)), (0, height))
+
+    def test_clip(self):
+        transform = TouchTransform(100, 100, 0, 100, 100)
+        self.assertEqual(transform.point((-5, 150)), (0, 100))
+
+    def test_cached(self):
+        self.assertIs(get_touch_transform(100, 200, 90, 10, 20), get_touch_transform(100, 200, 90, 10, 20))
+
+    def test_gesture(self):
+        transform = TouchTransform(100, 200, 0, 1000, 4000)
+        gesture = Gesture().down(0, 10, 20).move(0, 20, 40).up(0)
+        self.assertEqual(gesture.to_lines(transform), ['d 0 100 400 50', 'm 0 200 800 50', 'u 0'])
+
+
+if __name__ == '__main__':
+    unittest.main()